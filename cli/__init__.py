@@ -16,18 +16,30 @@ __copyright__ = '(C) 2010 Wijnand Modderman-Lenstra'
 __license__   = 'MIT'
 __url__       = 'http://code.maze.io/'
 
+from collections import deque
+import errno
+import os
 import re
+import socket
 import sys
 import textwrap
+from types import GeneratorType
+from cli.cache import LRU
 from cli.console import Console
-from cli.section import Root
-from cli.history import History
-from cli.parser import parse, TokenPipe
+from cli.errors import Errors
+from cli.executor import pool
+from cli.keys import Decoder
+from cli.section import Root, SectionType
+from cli.history import History, HistoryFile
+from cli.parser import parse, ParseError, TokenPipe
+from cli.render import Line, common_prefix
 from cli.sink import Sink
+from cli.stats import clock, stats
 from cli.filter import Filter
 
 MODE_INPUT, MODE_REVERSE_SEARCH, MODE_FORWARD_SEARCH = range(3)
 RE_NEWLINE = re.compile(r'(?:\r\n|\n)')
+RE_WORD = re.compile(r'[ \t]*[^ \t]+')
 
 
 class Interface(object):
@@ -37,8 +49,8 @@ class Interface(object):
         '\x1b\x5b\x42':         'down',
         '\x1b\x5b\x43':         'right',
         '\x1b\x5b\x44':         'left',
-        '\x1b\x5b\x35':         'pgup',
-        '\x1b\x5b\x36':         'pgdn',
+        '\x1b\x5b\x35\x7e':     'pgup',
+        '\x1b\x5b\x36\x7e':     'pgdn',
 
         '\x1b\x4f\x50':         'F1',
         '\x1b\x4f\x51':         'F2',
@@ -57,6 +69,13 @@ class Interface(object):
         '\x1b\x5b\x33\x7e':     'del',
         '\x1b\x4f\x46':         'end',
         '\x1b\x4f\x48':         'home',
+        '\x1b\x5b\x46':         'end',
+        '\x1b\x5b\x48':         'home',
+        '\x1b\x5b\x31\x7e':     'home',
+        '\x1b\x5b\x34\x7e':     'end',
+        '\x1b\x5b\x37\x7e':     'home',
+        '\x1b\x5b\x38\x7e':     'end',
+        '\x1b':                 'esc',
         '\x1b\x1b':             'esc',
         '\x09':                 'tab',
         '\x0a':                 'enter',
@@ -69,10 +88,21 @@ class Interface(object):
     }
 
     root_class = Root
+    decoder_class = Decoder
     filter_class = Filter
     history_class = History
-
-    def __init__(self, socket=None, name='cli', prompt='%(name)s %(path)s%% '):
+    history_file = None
+    cache_size = 256
+    profile_directory = None
+    error_size = 16
+    executor = pool
+    line_class = Line
+    offload = None
+    recv_size = 4096
+    stream_size = 64 * 1024
+
+    def __init__(self, socket=None, name='cli', prompt='%(name)s %(path)s%% ',
+        history=None):
         self.socket = socket or Console()
         self.name = name
         self.prompt_default = prompt
@@ -80,15 +110,34 @@ class Interface(object):
         self.buffer = ''
         self.linepos = 0
         self.mode = MODE_INPUT
+        self.search = ''
+        self.search_position = None
         self.char = self.last = chr(0)
-        self.history = self.history_class()
+        self.decoder = self.decoder_class(self.sequence)
+        if history is not None:
+            self.history = history
+        elif self.history_file:
+            self.history = HistoryFile(os.path.expanduser(self.history_file))
+        else:
+            self.history = self.history_class()
         self.histpos = -1
         self.root = self.root_class(self)
         self.filter = self.filter_class(self)
         self.section = self.root
-        self.errors = []
+        self.errors = Errors(self.error_size)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cache = LRU(self.cache_size, lambda: (SectionType.generation,
+            self.root.tree_generation))
+        self.sink = None
         self.is_running = True
-        self.send(self.prompt)
+        self.line = self.line_class()
+        self.output = []
+        self.output_size = 0
+        self.outgoing = deque()
+        self.outgoing_size = 0
+        self.send_prompt()
+        self.flush()
 
     @property
     def prompt(self):
@@ -107,28 +156,133 @@ class Interface(object):
         '''
         import select
         while self.is_running:
-            r, w, e = select.select([self], [], [], 0.1)
+            # only wake up if there is a partial escape sequence to resolve
+            r, w, e = select.select([self], [], [],
+                self.decoder.pending and self.decoder.timeout or None)
             if r:
                 self.read()
+            else:
+                self.expire()
+                self.flush()
+
+    def close(self):
+        '''
+        End the session; the default implementation exits the process.
+        '''
+        self.flush()
+        self.history.close()
+        sys.exit(0)
 
     def send(self, data):
-        # make sure we send correct newlines (including carriage return)
-        data = '\r\n'.join(RE_NEWLINE.split(data))
-        self.socket.send(data)
+        # we no longer know what the input line looks like
+        self.line.invalidate()
+        self.write(data)
+
+    def send_prompt(self):
+        self.send(self.prompt)
+        self.line.reset(self.prompt)
+
+    def beep(self):
+        self.write('\x07')
+
+    def write(self, data):
+        '''
+        Buffer output, it is sent to the client by :meth:`flush`.
+        '''
+        self.output.append(data)
+        self.output_size += len(data)
+
+    def stream(self, data):
+        '''
+        Send command output as it is produced, flushing whenever more than
+        ``stream_size`` bytes are buffered. On a blocking socket this makes
+        the command wait for the client to keep up; otherwise only
+        coroutines and offloaded commands are held back, see ``offload``
+        and :class:`cli.server.Session`.
+        '''
+        self.send(data)
+        if self.output_size >= self.stream_size:
+            self.flush()
+
+    def flush(self):
+        '''
+        Send buffered output to the client. All output that was produced
+        while processing a chunk of input is sent in a single call, unless
+        the socket does not accept all of it; whatever is left is kept
+        until the next flush.
+        '''
+        if self.output:
+            # make sure we send correct newlines (including carriage return)
+            data = '\r\n'.join(RE_NEWLINE.split(''.join(self.output)))
+            self.output = []
+            self.output_size = 0
+            self.outgoing.append(data)
+            self.outgoing_size += len(data)
+
+        while self.outgoing:
+            data = self.outgoing[0]
+            try:
+                sent = self.socket.send(data)
+            except socket.error, error:
+                if error.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+
+            # file-like objects write everything
+            if sent is None:
+                sent = len(data)
+            self.bytes_out += sent
+            if stats.enabled:
+                stats.count('bytes out', sent)
+            self.outgoing_size -= sent
+            if sent < len(data):
+                self.outgoing[0] = data[sent:]
+            else:
+                self.outgoing.popleft()
+
         # TCP sockets don't have a flush method
         if hasattr(self.socket, "flush"):
             self.socket.flush()
 
     def sendline(self, data=''):
         self.send(data + '\r\n')
-        self.send(self.prompt)
+        self.send_prompt()
 
     def fileno(self):
         return self.socket.fileno()
 
     def read(self):
+        self.feed(self.socket.recv(self.recv_size))
+        self.flush()
+
+    def feed(self, data):
+        '''
+        Process a chunk of input received from the client, escape sequences
+        may be split over multiple chunks.
+        '''
+        # end of file, the other end went away
+        if not data:
+            self.is_running = False
+            self.close()
+            return
+
+        self.bytes_in += len(data)
+        if stats.enabled:
+            stats.count('bytes in', len(data))
+        for key in self.decoder.feed(data):
+            self.handle_key(key)
+
+    def expire(self):
+        '''
+        Handle a partial escape sequence that has been pending for too long,
+        such as a single escape key press.
+        '''
+        for key in self.decoder.expire():
+            self.handle_key(key)
+
+    def handle_key(self, key):
         self.last = self.char
-        self.char = self.socket.recv(1)
+        self.char = key
 
         # ^C / ^D
         if self.char in ['\x03', '\x04']:
@@ -136,14 +290,14 @@ class Interface(object):
                 if self.section != self.root:
                     self.section = self.section.parent
                 self.buffer = ''
-                self.send('\x07')
+                self.beep()
                 self.sendline('')
                 self.history.reset()
             else:
                 sink = Sink()
                 self.root.exit(sink)
                 self.send(sink.output)
-                sys.exit(0)
+                self.close()
 
         # ^Z
         elif self.char == '\x1a':
@@ -155,7 +309,7 @@ class Interface(object):
                 sink = Sink()
                 self.root.exit(sink)
                 self.send(sink.output)
-                sys.exit(0)
+                self.close()
 
         # ^H / backspace
         elif self.char in ['\x08', '\x7f']:
@@ -166,30 +320,32 @@ class Interface(object):
                 ])
                 self.buffer_update(buffer, self.linepos - 1)
 
-            elif self.mode == MODE_REVERSE_SEARCH:
-                filter = self.buffer[:-1]
-                self.handle_search(self.char, filter, self.history[::-1])
-
-            elif self.mode == MODE_FORWARD_SEARCH:
-                filter = self.buffer[:-1]
-                self.handle_search(self.char, filter, self.history)
+            else:
+                # a shorter filter may match lines we skipped, start over
+                self.handle_search(self.buffer[:-1])
 
         # ^I / tab
         elif self.char == '\x09':
             tabs = self.section.complete(self.buffer)
             if len(tabs) == 0:
-                self.send('\x07') # beep
+                self.beep()
             elif len(tabs) == 1:
                 self.buffer_update(tabs[0] + ' ')
             else:
-                # remove everything upto the last completed item so that
-                # completing the items won't clutter your display
-                if ' ' in self.buffer:
-                    repl = ' '.join(self.buffer.split(' ')[:-1])
-                    tabs = [tab.replace(repl, '').lstrip() for tab in tabs]
-                tabs.sort()
-                self.sendline('\n\r%s' % (' '.join(tabs),))
-                self.buffer_update(self.buffer)
+                # the completions are sorted, so the longest common prefix of
+                # all of them is the common prefix of the first and the last
+                common = tabs[0][:common_prefix(tabs[0], tabs[-1])]
+                if len(common) > len(self.buffer) and \
+                    common.startswith(self.buffer):
+                    self.buffer_update(common)
+                else:
+                    # remove everything upto the last completed item so that
+                    # completing the items won't clutter your display
+                    if ' ' in self.buffer:
+                        repl = ' '.join(self.buffer.split(' ')[:-1])
+                        tabs = [tab.replace(repl, '').lstrip() for tab in tabs]
+                    self.sendline('\n\r%s' % (' '.join(tabs),))
+                    self.buffer_update(self.buffer)
 
         # ?
         elif self.char == '?':
@@ -198,45 +354,49 @@ class Interface(object):
                 self.sendline('\x07')
             elif len(tabs) == 1:
                 tabs = self.section.complete(tabs[0] + ' ', include_root=False)
-                tabs.sort()
                 self.send('\r\n')
                 pads = ' ' * len(self.prompt)
                 for item in tabs:
                     self.send(''.join([pads, item, '\r\n']))
                 self.buffer_update(self.buffer)
             else:
-                tabs.sort()
                 self.send('\r\n')
                 pads = ' ' * len(self.prompt)
                 size = max(map(len, tabs))
                 fmts = '%%s%%-%ds %%s\r\n' % (size,)
                 for item in tabs:
-                    #self.send(''.join([pads, item, '\r\n']))
-                    docs = self.root._get_syntax(item)
-                    self.send(fmts % (pads, item, docs))
+                    help = self.section._get_help(item)
+                    self.send(fmts % (pads, item, help and help.arguments or
+                        ''))
                 self.buffer_update(self.buffer)
 
         # escape
-        elif self.char in ('\x1b', '\x1b\x4f', '\x1b\x5b'):
-            # read complete escape sequence
-            while self.char in ('\x1b', '\x1b\x4f', '\x1b\x5b') or \
-                self.char[:3] in ('\x1b\x5b\x31', '\x1b\x5b\x32', '\x1b\x5b\x33'):
-                self.char += self.socket.recv(1)
-                if self.char[-1] == '\x7e':
-                    break
+        elif self.char.startswith('\x1b'):
             self.handle_special(self.char)
 
         # ^R / reverse-search
         elif self.char == '\x12':
-            self.mode = MODE_REVERSE_SEARCH
-            self.prompt_alternate = '(reverse-search): '
-            self.buffer_update('')
+            if self.mode == MODE_REVERSE_SEARCH and self.search:
+                # search for the next older match
+                self.handle_search(self.buffer, self.search_position - 1)
+            else:
+                self.mode = MODE_REVERSE_SEARCH
+                self.prompt_alternate = '(reverse-search): '
+                self.search = ''
+                self.search_position = None
+                self.buffer_update('')
 
         # ^S / forward-search
         elif self.char == '\x13':
-            self.mode = MODE_FORWARD_SEARCH
-            self.prompt_alternate = '(forward-search): '
-            self.buffer_update('')
+            if self.mode == MODE_FORWARD_SEARCH and self.search:
+                # search for the next newer match
+                self.handle_search(self.buffer, self.search_position + 1)
+            else:
+                self.mode = MODE_FORWARD_SEARCH
+                self.prompt_alternate = '(forward-search): '
+                self.search = ''
+                self.search_position = None
+                self.buffer_update('')
 
         # ^W / erase-word
         elif self.char == '\x17':
@@ -264,7 +424,7 @@ class Interface(object):
             else:
                 self.buffer_update(self.buffer, self.linepos)
 
-        # regular self.characters
+        # regular self.characters, pasted text arrives as a single key
         elif self.char >= '\x20' and self.char < '\x7f':
             if self.mode == MODE_INPUT:
                 #self.buffer += self.char
@@ -274,15 +434,13 @@ class Interface(object):
                     self.char,
                     self.buffer[self.linepos:]
                 ])
-                self.buffer_update(buffer, self.linepos + 1)
+                self.buffer_update(buffer, self.linepos + len(self.char))
 
-            elif self.mode == MODE_REVERSE_SEARCH:
-                filter = self.buffer + self.char
-                self.handle_search(self.char, filter, self.history[::-1])
-
-            elif self.mode == MODE_FORWARD_SEARCH:
-                filter = self.buffer + self.char
-                self.handle_search(self.char, filter, self.history)
+            else:
+                # lines that did not match the filter will not match the
+                # longer filter, so resume from the last hit
+                self.handle_search(self.buffer + self.char,
+                    self.search_position)
 
         # ^L / redraw
         elif self.char == '\x0c':
@@ -305,30 +463,33 @@ class Interface(object):
             self.sendline('chr(0x%02x)' % (ord(self.char),))
 
     def buffer_update(self, new_buffer, linepos=None):
-        self.send('\r%s%s' % (self.prompt, ' ' * len(self.buffer)))
         self.buffer = new_buffer
-        self.send('\r%s%s' % (self.prompt, self.buffer))
         if linepos is None:
             self.linepos = len(self.buffer)
         else:
             # normalise
-            linepos = max(0, min(len(self.buffer), linepos))
-            self.send('\b' * (max(0, len(self.buffer) - linepos)))
-            self.linepos = linepos
+            self.linepos = max(0, min(len(self.buffer), linepos))
+        # only send what changed on the terminal
+        self.write(self.line.update(self.prompt, self.buffer, self.linepos))
 
-    def handle_search(self, char, filter, history):
-        self.search = ''
-        for item in history:
-            if filter in item:
-                self.search = item
-                break
+    def handle_search(self, filter, position=None):
+        '''
+        Search the history for a line containing ``filter``, backward or
+        forward from ``position`` depending on the search mode; without a
+        position the search starts at the newest or oldest line.
+        '''
+        if self.mode == MODE_REVERSE_SEARCH:
+            number = self.history.search_backward(filter, position)
+        else:
+            number = self.history.search_forward(filter, position or 0)
 
-        if self.search:
-            self.buffer_update(self.search)
-            self.buffer = filter
-            self.send('\b' * (len(self.search) - self.search.index(filter)))
+        if number is None:
+            self.beep()
         else:
-            self.send('\x07') # beep
+            self.search = self.history[number]
+            self.search_position = number
+            self.buffer_update(self.search, self.search.index(filter))
+            self.buffer = filter
 
     def handle_command(self, line):
         self.buffer = ''
@@ -338,35 +499,23 @@ class Interface(object):
             return
 
         if line:
-            sink = Sink()
-
-            # parse user input, split into pipe chunks
-            pipe = []
-            part = []
-            for token in parse(line):
-                if isinstance(token, TokenPipe):
-                    pipe.append(' '.join(part))
-                    part = []
-                else:
-                    part.append(str(token))
-            if part:
-                pipe.append(' '.join(part))
+            sink = Sink(stream=self.stream)
 
             # evaluate pipe
             try:
-                for i, part in enumerate(pipe):
-                    # first pipe entry is a command
-                    if i == 0:
-                        if not self.section.execute(sink, part):
-                            break
-                    # all that follow are a filter
-                    else:
-                        if not self.filter.execute(sink, part):
-                            break
-                self.send(sink.output)
-                self.history.append(line)
-                self.history.reset()
-                self.buffer_update('')
+                steps = self.compile(line)
+                if not steps:
+                    # nothing but a comment
+                    self.mode = MODE_INPUT
+                    self.sendline('')
+                    return
+                self.run(self.evaluate(sink, steps, line))
+                return
+            except ParseError, error:
+                # point out where in the line parsing failed
+                self.send(' ' * (len(self.prompt) + error.position))
+                self.send('^\r\n')
+                self.sendline('error: %s' % (error.message,))
                 return
             except Exception, e:
                 raise
@@ -402,11 +551,143 @@ class Interface(object):
 
         self.sendline('what? you need "help"')
 
+    def compile(self, line):
+        '''
+        Parse the line and resolve the commands in the pipe, returns the
+        steps to evaluate. Compiled lines are cached per section, until
+        the section tree changes.
+        '''
+        key = (tuple(self.section.path), line)
+        steps = self.cache.get(key)
+        if steps is not None:
+            return steps
+
+        # parse user input, split into pipe chunks
+        tokens = list(parse(line))
+        pipe = []
+        part = []
+        for token in tokens:
+            if isinstance(token, TokenPipe):
+                pipe.append(part)
+                part = []
+            else:
+                part.append(str(token))
+        if part:
+            pipe.append(part)
+        if not pipe:
+            # a comment, there is nothing to run
+            self.cache[key] = []
+            return []
+
+        node, handler, args = resolved = self.section.resolve(pipe[0])
+        if getattr(handler, 'raw', False):
+            # the command takes the rest of the line as it is
+            index = len(pipe[0]) - len(args)
+            if index < len(tokens):
+                args = [line[tokens[index].position:]]
+            else:
+                args = ['']
+            steps = [(self.section, pipe[0], (node, handler, args))]
+            self.cache[key] = steps
+            return steps
+
+        # first pipe entry is a command, all that follow are a filter; the
+        # filters are set up first, so the command output streams through
+        steps = [(self.filter, part, self.filter.resolve(part))
+            for part in pipe[1:]]
+        steps.append((self.section, pipe[0], resolved))
+        self.cache[key] = steps
+        return steps
+
+    def evaluate(self, sink, steps, line):
+        '''
+        Evaluate compiled pipe steps. This is a generator, it yields
+        ``None`` whenever a command implemented as a coroutine is waiting,
+        or the :class:`~cli.executor.Job` of a command that is running in
+        the worker pool.
+        '''
+        self.sink = sink
+        for step in self.pipeline(sink, steps):
+            yield step
+
+        self.sink = None
+        sink.close()
+        if sink.cancelled:
+            self.send('^C\r\n')
+        self.send(sink.output)
+        self.history.append(line)
+        self.history.reset()
+        self.buffer_update('')
+
+    def pipeline(self, sink, steps):
+        '''
+        Dispatch compiled pipe steps, writing to the sink. This yields like
+        :meth:`evaluate`, closing the sink is left to the caller.
+        '''
+        for node, part, resolved in steps:
+            timed = stats.enabled
+            if timed:
+                start = clock()
+            if node is self.filter:
+                done = node.dispatch(sink, part, resolved)
+            elif sink.blocking:
+                # the filters wait for child processes, run the command and
+                # its filters in a worker instead of blocking the session
+                done = node.dispatch(sink, part, resolved, 'thread')
+            elif sink.stream is not None and not getattr(resolved[1],
+                'coroutine', False):
+                # a plain command can not wait for the client to keep up,
+                # unless it is offloaded; by default it runs right here
+                done = node.dispatch(sink, part, resolved, self.offload)
+            else:
+                done = node.dispatch(sink, part, resolved)
+
+            # coroutine or offloaded command, see Section.resume and
+            # Section.offload
+            if isinstance(done, GeneratorType):
+                for done in done:
+                    if done is not True and done is not False:
+                        yield done
+
+            # filters are timed as the output passes, see Sink.build
+            if timed and resolved[0] is not None and node is not self.filter:
+                stats.record(self.command_name(resolved), clock() - start)
+
+            if not done:
+                # the filters have nothing to report on, see Sink.close
+                sink.failed = True
+                break
+
+    def command_name(self, resolved):
+        '''
+        Returns the name statistics are recorded under for a resolved
+        command, the path to the command.
+        '''
+        owner, handler, args = resolved
+        return ' '.join(owner.path + [handler.__name__])
+
+    def run(self, task):
+        '''
+        Run a command task to completion; subclasses that drive many
+        sessions from a single event loop step the task cooperatively.
+        '''
+        for step in task:
+            if step is not None:
+                # wait for the job in the worker pool to make progress
+                step.wait()
+
+    def cancel(self):
+        '''
+        Cancel the running command, see :meth:`cli.sink.Sink.cancel`.
+        '''
+        if self.sink is not None:
+            self.sink.cancel()
+
     def handle_special(self, sequence):
         #print 'special', repr(line), '\r\n'
 
-        if sequence in self.sequence:
-            key = self.sequence[sequence]
+        key = self.decoder.lookup(sequence)
+        if key is not None:
 
             # esc
             if key == 'esc':
@@ -428,6 +709,34 @@ class Interface(object):
             elif key == 'right':
                 self.buffer_update(self.buffer, self.linepos + 1)
 
+            # home
+            elif key == 'home':
+                self.buffer_update(self.buffer, 0)
+
+            # end
+            elif key == 'end':
+                self.buffer_update(self.buffer)
+
+            # del
+            elif key == 'del':
+                buffer = ''.join([
+                    self.buffer[:self.linepos],
+                    self.buffer[self.linepos + 1:]
+                ])
+                self.buffer_update(buffer, self.linepos)
+
+            # word left
+            elif key in ('ctrl-left', 'alt-left'):
+                buffer = self.buffer[:self.linepos].rstrip(' \t')
+                self.buffer_update(self.buffer,
+                    max(buffer.rfind(' '), buffer.rfind('\t')) + 1)
+
+            # word right
+            elif key in ('ctrl-right', 'alt-right'):
+                match = RE_WORD.search(self.buffer, self.linepos)
+                self.buffer_update(self.buffer,
+                    match and match.end() or len(self.buffer))
+
             # down
             elif key == 'down':
                 if self.history:
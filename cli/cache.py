@@ -0,0 +1,85 @@
+#! /usr/bin/env python
+#
+#                         _______
+#   ____________ _______ _\__   /_________       ___  _____
+#  |    _   _   \   _   |   ____\   _    /      |   |/  _  \
+#  |    /   /   /   /   |  |     |  /___/   _   |   |   /  /
+#  |___/___/   /___/____|________|___   |  |_|  |___|_____/
+#          \__/                     |___|
+#
+#
+# (c) 2010 Wijnand 'maze' Modderman-Lenstra - http://maze.io/
+#
+
+__author__    = 'Wijnand Modderman-Lenstra <maze@pyth0n.org>'
+__copyright__ = '(C) 2010 Wijnand Modderman-Lenstra'
+__license__   = 'MIT'
+__url__       = 'http://code.maze.io/'
+
+from collections import OrderedDict
+
+
+class LRU(object):
+    '''
+    Least recently used cache of at most ``size`` items.
+
+    If a ``generation`` callable is given, the cache is cleared as soon as
+    the value it returns changes, so entries that depend on some outside
+    state are invalidated when that state changes.
+    '''
+
+    def __init__(self, size=256, generation=None):
+        self.size = size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.generation = generation
+        self.current = generation and generation()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        self.validate()
+        return key in self.items
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if self.size <= 0:
+            return
+        self.validate()
+        if key in self.items:
+            del self.items[key]
+        elif len(self.items) >= self.size:
+            self.items.popitem(last=False)
+        self.items[key] = value
+
+    def validate(self):
+        if self.generation is not None:
+            current = self.generation()
+            if current != self.current:
+                self.items.clear()
+                self.current = current
+
+    def get(self, key, default=None):
+        self.validate()
+        try:
+            value = self.items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        else:
+            # move to the most recently used end
+            self.items[key] = value
+            self.hits += 1
+            return value
+
+    def clear(self):
+        self.items.clear()
+        self.hits = 0
+        self.misses = 0
@@ -16,6 +16,7 @@ __copyright__ = '(C) 2010 Wijnand Modderman-Lenstra'
 __license__   = 'MIT'
 __url__       = 'http://code.maze.io/'
 
+import os
 import sys
 import termios
 import tty
@@ -76,4 +77,6 @@ class Console(object):
         return sys.stdout.write(string)
 
     def recv(self, bufsize=4096, flags=0):
-        return sys.stdin.read(bufsize)
+        # read whatever is available, sys.stdin.read would block until
+        # bufsize bytes are read
+        return os.read(self.fileno(), bufsize)
@@ -0,0 +1,73 @@
+#! /usr/bin/env python
+#
+#                         _______
+#   ____________ _______ _\__   /_________       ___  _____
+#  |    _   _   \   _   |   ____\   _    /      |   |/  _  \
+#  |    /   /   /   /   |  |     |  /___/   _   |   |   /  /
+#  |___/___/   /___/____|________|___   |  |_|  |___|_____/
+#          \__/                     |___|
+#
+#
+# (c) 2010 Wijnand 'maze' Modderman-Lenstra - http://maze.io/
+#
+
+__author__    = 'Wijnand Modderman-Lenstra <maze@pyth0n.org>'
+__copyright__ = '(C) 2010 Wijnand Modderman-Lenstra'
+__license__   = 'MIT'
+__url__       = 'http://code.maze.io/'
+
+from collections import deque
+import sys
+import traceback
+
+
+class Errors(object):
+    '''
+    Ring buffer of the last ``size`` errors of a session, with their
+    tracebacks. A traceback is kept as it was raised and only formatted
+    when it is asked for; formatting it releases the frames it refers to.
+
+    Errors are numbered from the most recent one, which is number 1.
+    '''
+
+    def __init__(self, size=16):
+        self.size = size
+        self.items = deque(maxlen=size)
+        self.total = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def append(self, error, trace=None):
+        '''
+        Add an error, with its traceback as a string or a traceback object;
+        by default the traceback of the exception being handled is taken.
+        '''
+        if trace is None:
+            trace = sys.exc_info()[2]
+        self.items.append([error, trace])
+        self.total += 1
+
+    def error(self, number=1):
+        '''
+        Returns the error with the given number, or ``None``.
+        '''
+        if 0 < number <= len(self.items):
+            return self.items[-number][0]
+
+    def traceback(self, number=1):
+        '''
+        Returns the formatted traceback of the error with the given number,
+        or ``None``.
+        '''
+        if not 0 < number <= len(self.items):
+            return None
+        item = self.items[-number]
+        error, trace = item
+        if not isinstance(trace, basestring):
+            trace = item[1] = ''.join(traceback.format_exception(
+                error.__class__, error, trace))
+        return trace
+
+    def clear(self):
+        self.items.clear()
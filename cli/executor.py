@@ -0,0 +1,454 @@
+#! /usr/bin/env python
+#
+#                         _______
+#   ____________ _______ _\__   /_________       ___  _____
+#  |    _   _   \   _   |   ____\   _    /      |   |/  _  \
+#  |    /   /   /   /   |  |     |  /___/   _   |   |   /  /
+#  |___/___/   /___/____|________|___   |  |_|  |___|_____/
+#          \__/                     |___|
+#
+#
+# (c) 2010 Wijnand 'maze' Modderman-Lenstra - http://maze.io/
+#
+
+__author__    = 'Wijnand Modderman-Lenstra <maze@pyth0n.org>'
+__copyright__ = '(C) 2010 Wijnand Modderman-Lenstra'
+__license__   = 'MIT'
+__url__       = 'http://code.maze.io/'
+
+from cli.sink import BrokenPipe, Cancelled, Sink
+from collections import deque
+from types import GeneratorType
+import multiprocessing
+import os
+import Queue
+import sys
+import threading
+import traceback
+
+
+class RemoteError(Exception):
+    '''
+    An exception raised in a child process that could not be passed on.
+    '''
+    pass
+
+
+class Job(object):
+    '''
+    A command running in an :class:`Executor`.
+
+    Output the command writes is queued by :meth:`write`, which is safe to
+    call from the worker thread, and is handed to the session by
+    :meth:`drain`. Once more than ``high_water`` bytes are queued, the
+    worker waits for the session to catch up; meanwhile its
+    :class:`Executor` does not count the worker as running.
+    '''
+
+    high_water = 64 * 1024
+
+    def __init__(self, func, sink, *args):
+        self.func = func
+        self.sink = sink
+        self.args = args
+        self.done = False
+        self.result = None
+        self.error = None
+        self.traceback = None
+        self.output = deque()
+        self.size = 0
+        self.lock = threading.Condition()
+        self.changed = threading.Event()
+        self.callback = None
+        self.executor = None
+
+    def run(self):
+        try:
+            if not self.sink.cancelled:
+                self.result = self.func(self.sink, *self.args)
+                if isinstance(self.result, GeneratorType):
+                    for step in self.result:
+                        pass
+        except:
+            self.fail()
+
+        # filters that wait for child processes finish in this thread as
+        # well, so they do not block the session
+        if self.sink.blocking:
+            if self.error is not None and \
+                not isinstance(self.error, BrokenPipe):
+                self.sink.failed = True
+            try:
+                self.sink.close()
+            except:
+                if self.error is None:
+                    self.fail()
+        self.done = True
+        self.wakeup()
+
+    def fail(self):
+        self.error = sys.exc_info()[1]
+        # errors from child processes carry their own traceback, the
+        # others are formatted when needed, see cli.errors.Errors
+        self.traceback = getattr(self.error, 'traceback', None) or \
+            sys.exc_info()[2]
+
+    def write(self, data):
+        self.lock.acquire()
+        try:
+            # the client is not reading, let another thread take over the
+            # jobs of other sessions while we wait
+            parked = self.size >= self.high_water and \
+                self.executor is not None
+            if parked:
+                self.executor.park()
+            try:
+                while self.size >= self.high_water and \
+                    not self.sink.cancelled:
+                    self.lock.wait(0.1)
+            finally:
+                if parked:
+                    self.executor.unpark()
+            # the session drains all queued output at once, it only needs
+            # a wake up for the first
+            first = not self.output
+            self.output.append(data)
+            self.size += len(data)
+        finally:
+            self.lock.release()
+        if first:
+            self.wakeup()
+
+    def drain(self, stream):
+        '''
+        Pass the queued output on to ``stream``.
+        '''
+        self.lock.acquire()
+        try:
+            output = list(self.output)
+            self.output.clear()
+            self.size = 0
+            self.lock.notifyAll()
+        finally:
+            self.lock.release()
+        for data in output:
+            stream(data)
+
+    def notify(self, callback, *args):
+        '''
+        Call ``callback`` with ``args`` whenever the job produced output or
+        is done. The callback is called from the worker thread.
+        '''
+        self.callback = (callback, args)
+        if self.changed.isSet():
+            callback(*args)
+
+    def wakeup(self):
+        self.changed.set()
+        if self.callback is not None:
+            callback, args = self.callback
+            callback(*args)
+
+    def wait(self, timeout=None):
+        '''
+        Wait until the job produced output or is done.
+        '''
+        self.changed.wait(timeout)
+
+
+class Executor(object):
+    '''
+    Pool of worker threads running commands. The threads are started as
+    jobs are submitted, up to ``workers`` threads running jobs at once.
+
+    A job that waits for its session to drain its output, see
+    :meth:`Job.write`, does not count as running; another thread is
+    started in its place if there are jobs waiting, so clients that do not
+    read do not hold up the commands of other sessions. There is one such
+    thread for every stalled client.
+    '''
+
+    def __init__(self, workers=4):
+        self.workers = workers
+        self.threads = []
+        self.idle = 0
+        self.parked = 0
+        self.lock = threading.Lock()
+        self.queue = Queue.Queue()
+
+    def submit(self, job):
+        job.executor = self
+        self.queue.put(job)
+        self.grow()
+        return job
+
+    def grow(self):
+        # start a thread if no idle thread is left for the waiting jobs
+        self.lock.acquire()
+        try:
+            if self.idle < self.queue.qsize() and \
+                len(self.threads) - self.parked < self.workers:
+                thread = threading.Thread(target=self.work)
+                thread.setDaemon(True)
+                thread.start()
+                self.threads.append(thread)
+        finally:
+            self.lock.release()
+
+    def park(self):
+        self.lock.acquire()
+        try:
+            self.parked += 1
+        finally:
+            self.lock.release()
+        self.grow()
+
+    def unpark(self):
+        self.lock.acquire()
+        try:
+            self.parked -= 1
+        finally:
+            self.lock.release()
+
+    def work(self):
+        while True:
+            self.lock.acquire()
+            try:
+                # a thread started in place of a parked one stops once
+                # there are too many running again
+                if len(self.threads) - self.parked > self.workers:
+                    self.threads.remove(threading.currentThread())
+                    return
+                self.idle += 1
+            finally:
+                self.lock.release()
+            job = self.queue.get()
+            self.lock.acquire()
+            try:
+                self.idle -= 1
+            finally:
+                self.lock.release()
+            if job is None:
+                break
+            job.run()
+
+    def shutdown(self):
+        for thread in list(self.threads):
+            self.queue.put(None)
+        for thread in list(self.threads):
+            thread.join()
+        self.threads = []
+
+
+def close_fds(*keep):
+    '''
+    Close all file descriptors except for stdin, stdout, stderr and the
+    given ones, so a forked child does not hold on to client connections.
+    '''
+    try:
+        maxfd = os.sysconf('SC_OPEN_MAX')
+    except (AttributeError, ValueError):
+        maxfd = 1024
+    start = 3
+    for fd in sorted(keep) + [maxfd]:
+        os.closerange(start, fd)
+        start = fd + 1
+
+
+def fork(target, *args):
+    '''
+    Run ``target(conn, *args)`` in a forked child process, where ``conn``
+    is the child end of a pipe. Returns the process and the parent end of
+    the pipe.
+    '''
+    conn, child = multiprocessing.Pipe()
+
+    def main():
+        conn.close()
+        close_fds(child.fileno())
+        target(child, *args)
+
+    process = multiprocessing.Process(target=main)
+    process.daemon = True
+    process.start()
+    child.close()
+    return process, conn
+
+
+class Batch(object):
+    '''
+    Collect output written in a child process and send it to the parent in
+    chunks of at least ``size`` bytes.
+    '''
+
+    def __init__(self, conn, size=16 * 1024):
+        self.conn = conn
+        self.size = size
+        self.chunks = []
+        self.length = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.length += len(data)
+        if self.length >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.chunks:
+            self.conn.send(('data', ''.join(self.chunks)))
+            self.chunks = []
+            self.length = 0
+
+
+def serve_call(conn, func, args):
+    '''
+    Child side of :func:`call_in_process`.
+    '''
+    batch = Batch(conn)
+    try:
+        result = func(Sink(stream=batch.write), *args)
+        if isinstance(result, GeneratorType):
+            for step in result:
+                pass
+    except:
+        error = sys.exc_info()[1]
+        trace = traceback.format_exc()
+        batch.flush()
+        try:
+            conn.send(('error', (error, trace)))
+        except Exception:
+            conn.send(('error', (RemoteError(str(error)), trace)))
+    else:
+        batch.flush()
+        conn.send(('done', None))
+    conn.close()
+
+
+def call_in_process(sink, func, *args):
+    '''
+    Run the command ``func`` in a child process and write its output to
+    ``sink`` as it arrives. This blocks, so it is meant to run in an
+    :class:`Executor` worker. The child is terminated if the sink is
+    cancelled or broken.
+    '''
+    process, conn = fork(serve_call, func, args)
+    try:
+        while True:
+            if sink.cancelled:
+                raise Cancelled()
+            if not conn.poll(0.1):
+                if not process.is_alive() and not conn.poll():
+                    raise RemoteError('command process died')
+                continue
+
+            kind, value = conn.recv()
+            if kind == 'data':
+                sink.write(value)
+            elif kind == 'done':
+                return
+            else:
+                error, trace = value
+                error.traceback = trace
+                raise error
+    finally:
+        conn.close()
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+
+def serve_batches(conn):
+    '''
+    Child side of :class:`Worker`.
+    '''
+    while True:
+        try:
+            func, args, data = conn.recv()
+            conn.send(func(data, *args))
+        except (EOFError, IOError):
+            # the parent went away
+            break
+
+
+class Worker(object):
+    '''
+    Child process applying ``func(data, *args)`` to the batches sent to it,
+    and sending back the results in the same order. The function is sent
+    along with every batch, so it has to be a module level function; a
+    worker serves any number of commands, see :class:`ProcessPool`.
+    '''
+
+    def __init__(self):
+        self.process, self.conn = fork(serve_batches)
+        self.pending = 0
+
+    def send(self, func, args, data):
+        self.conn.send((func, args, data))
+        self.pending += 1
+
+    def recv(self):
+        result = self.conn.recv()
+        self.pending -= 1
+        return result
+
+    def close(self):
+        self.conn.close()
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+
+class ProcessPool(object):
+    '''
+    Child processes kept around between commands, so filters that run in
+    child processes do not fork for every command. Workers are started as
+    they are needed, and up to ``idle`` of them are kept when released.
+    '''
+
+    def __init__(self, idle=8):
+        self.idle = idle
+        self.workers = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        self.lock.acquire()
+        try:
+            while self.workers:
+                worker = self.workers.pop()
+                if worker.process.is_alive():
+                    return worker
+                worker.close()
+        finally:
+            self.lock.release()
+        return Worker()
+
+    def release(self, worker):
+        '''
+        Return a worker to the pool; a worker that still has batches to
+        answer, for example after the filter stopped early, is closed.
+        '''
+        self.lock.acquire()
+        try:
+            if not worker.pending and len(self.workers) < self.idle:
+                self.workers.append(worker)
+                return
+        finally:
+            self.lock.release()
+        worker.close()
+
+    def shutdown(self):
+        self.lock.acquire()
+        try:
+            workers, self.workers = self.workers, []
+        finally:
+            self.lock.release()
+        for worker in workers:
+            worker.close()
+
+
+# executor shared by all interfaces
+pool = Executor()
+
+# child processes shared by all filters
+process_pool = ProcessPool()
@@ -16,12 +16,490 @@ __copyright__ = '(C) 2010 Wijnand Modderman-Lenstra'
 __license__   = 'MIT'
 __url__       = 'http://code.maze.io/'
 
+from cli.cache import LRU
+from cli.executor import process_pool
 from cli.section import Section, command
+from cli.sink import BrokenPipe
+from array import array
+from collections import deque
+from itertools import cycle
 import getopt
 import re
+import threading
+
+
+def block_safe(pattern):
+    '''
+    Returns True if the pattern matches the same at the start of a line in a
+    block of lines as it does on the line on its own. Patterns that look
+    past the line, through lookarounds or string anchors, are not safe.
+    '''
+    return not any(part in pattern for part in ('(?=', '(?!', '(?<', '\\A',
+        '\\Z'))
+
+
+def find_literal(text):
+    '''
+    Returns a function that yields the ``(start, end)`` offsets of the lines
+    in a block that start with ``text``, using plain substring search.
+    '''
+    needle = '\n' + text
+
+    def find(block):
+        size = len(block)
+        pos = 0
+        while pos <= size:
+            if not block.startswith(text, pos):
+                pos = block.find(needle, pos)
+                if pos == -1:
+                    return
+                pos += 1
+            end = block.find('\n', pos)
+            if end == -1:
+                end = size
+            yield pos, end
+            pos = end + 1
+
+    return find
+
+
+def find_pattern(pattern, flags=0):
+    '''
+    Returns a function that yields the ``(start, end)`` offsets of the lines
+    in a block that match the pattern, as ``re.match`` would on each line.
+    '''
+    match = re.compile(pattern, flags).match
+    if not block_safe(pattern):
+        def find(block):
+            size = len(block)
+            pos = 0
+            while pos <= size:
+                end = block.find('\n', pos)
+                if end == -1:
+                    end = size
+                if match(block[pos:end]):
+                    yield pos, end
+                pos = end + 1
+
+        return find
+
+    search = re.compile('^(?:%s)' % (pattern,), flags | re.M).search
+
+    def find(block):
+        size = len(block)
+        pos = 0
+        while pos <= size:
+            found = search(block, pos)
+            if found is None:
+                return
+            pos = found.start()
+            end = block.find('\n', pos)
+            if end == -1:
+                end = size
+            # a match running into the next lines has to match on its own
+            if found.end() <= end or match(block, pos, end):
+                yield pos, end
+            pos = end + 1
+
+    return find
+
+
+# finders are shared by all sessions, keyed by (pattern, flags, literal);
+# sessions may run in threads of their own, so the cache is locked
+finders = LRU(256)
+finders_lock = threading.Lock()
+
+
+def finder(pattern, flags=0, literal=False):
+    '''
+    Returns the (cached) function that finds the lines matching ``pattern``
+    in a block, see :func:`find_literal` and :func:`find_pattern`.
+    '''
+    key = (pattern, flags, literal)
+    finders_lock.acquire()
+    try:
+        find = finders.get(key)
+    finally:
+        finders_lock.release()
+    if find is None:
+        if literal:
+            find = find_literal(pattern)
+        else:
+            find = find_pattern(pattern, flags)
+        finders_lock.acquire()
+        try:
+            finders[key] = find
+        finally:
+            finders_lock.release()
+    return find
+
+
+def select_lines(block, find, invert=False):
+    '''
+    Yields the lines of the block found by ``find``, or the lines not found
+    if ``invert`` is set.
+    '''
+    if not invert:
+        for start, end in find(block):
+            yield block[start:end]
+        return
+
+    pos = 0
+    for start, end in find(block):
+        if start > pos:
+            for line in block[pos:start - 1].split('\n'):
+                yield line
+        pos = end + 1
+    if pos <= len(block):
+        for line in block[pos:].split('\n'):
+            yield line
+
+
+def grep_block(target, find, invert=False, count=False):
+    '''
+    Filter stage that passes on the lines found by ``find``, or the lines
+    not found if ``invert`` is set, or only the number of such lines if
+    ``count`` is set.
+
+    This stage takes blocks of lines, so a whole write is matched at once.
+    '''
+    matches = 0
+    try:
+        while True:
+            block = (yield)
+            if count:
+                found = sum(1 for line in find(block))
+                if invert:
+                    found = block.count('\n') + 1 - found
+                matches += found
+            else:
+                for line in select_lines(block, find, invert):
+                    target.send(line)
+    except GeneratorExit:
+        if count:
+            target.send('%d' % (matches,))
+
+grep_block.blocks = True
+
+
+def grep_batch(data, pattern, flags=0, invert=False):
+    '''
+    Returns the lines of ``data``, separated by newlines, that match the
+    pattern, or do not match the pattern if ``invert`` is set; every line
+    ends with a newline. This runs in a child process, see
+    :func:`offload_lines`.
+    '''
+    return ''.join([line + '\n' for line in select_lines(data,
+        finder(pattern, flags), invert)])
+
+
+def count_lines(target):
+    '''
+    Filter stage that passes on the number of lines it received.
+    '''
+    count = 0
+    try:
+        while True:
+            count += (yield).count('\n') + 1
+    except GeneratorExit:
+        target.send('%d' % (count,))
+
+count_lines.blocks = True
+
+
+def offload_lines(target, func, args, processes=2, batch_size=1024):
+    '''
+    Filter stage that sends batches of about ``batch_size`` lines to
+    ``processes`` child processes, which apply ``func(data, *args)`` to
+    them. The batches are sent as a single string, the lines separated by
+    newlines, and ``func`` returns the lines to pass on the same way, each
+    ending with a newline. The lines are passed on in order.
+
+    Every child has at most one batch to work on, so neither side can get
+    stuck writing to the other. Waiting for the children blocks, so the
+    command writing to this stage runs in a worker thread. The children
+    are taken from, and returned to, the :class:`~cli.executor.ProcessPool`.
+    '''
+    workers = [process_pool.acquire() for x in xrange(processes)]
+    turns = cycle(workers)
+    pending = deque()
+
+    def collect():
+        data = pending.popleft().recv()
+        if data:
+            for line in data[:-1].split('\n'):
+                target.send(line)
+
+    def submit(batch):
+        if len(pending) == processes:
+            collect()
+        worker = turns.next()
+        worker.send(func, args, '\n'.join(batch))
+        pending.append(worker)
+
+    try:
+        batch = []
+        size = 0
+        try:
+            while True:
+                block = (yield)
+                batch.append(block)
+                size += block.count('\n') + 1
+                if size >= batch_size:
+                    submit(batch)
+                    batch = []
+                    size = 0
+        except GeneratorExit:
+            if batch:
+                submit(batch)
+            while pending:
+                collect()
+    finally:
+        for worker in workers:
+            process_pool.release(worker)
+
+offload_lines.blocks = True
+offload_lines.blocking = True
+
+
+def head_lines(target, count):
+    '''
+    Filter stage that passes on the first ``count`` lines, and then breaks
+    the pipe so the command producing the output is stopped.
+    '''
+    while count > 0:
+        target.send((yield))
+        count -= 1
+    raise BrokenPipe()
+
+
+def tail_lines(target, count):
+    '''
+    Filter stage that passes on the last ``count`` lines, holding on to no
+    more than ``count`` lines.
+    '''
+    lines = deque(maxlen=count)
+    try:
+        while True:
+            lines.append((yield))
+    except GeneratorExit:
+        for line in lines:
+            target.send(line)
+
+
+def begin_lines(target, find):
+    '''
+    Filter stage that passes on all lines from the first line found by
+    ``find`` onwards.
+    '''
+    started = False
+    while True:
+        block = (yield)
+        start = 0
+        if not started:
+            for start, end in find(block):
+                started = True
+                break
+            else:
+                continue
+        for line in block[start:].split('\n'):
+            target.send(line)
+
+begin_lines.blocks = True
+
+
+def section_lines(target, find):
+    '''
+    Filter stage that passes on the lines found by ``find`` that are not
+    indented, together with the indented lines following them.
+    '''
+    inside = False
+    while True:
+        block = (yield)
+        found = set(start for start, end in find(block))
+        pos = 0
+        for line in block.split('\n'):
+            if line[:1] not in (' ', '\t'):
+                inside = pos in found
+            if inside:
+                target.send(line)
+            pos += len(line) + 1
+
+section_lines.blocks = True
+
+
+def uniq_lines(target, count=False):
+    '''
+    Filter stage that passes on one of every run of equal lines, prefixed
+    with the length of the run if ``count`` is set.
+    '''
+    last = None
+    seen = 0
+    try:
+        while True:
+            line = (yield)
+            if line == last:
+                seen += 1
+                continue
+            if seen:
+                target.send(count and '%7d %s' % (seen, last) or last)
+            last = line
+            seen = 1
+    except GeneratorExit:
+        if seen:
+            target.send(count and '%7d %s' % (seen, last) or last)
+
+
+def split_fields(line, delimiter=None):
+    if delimiter is None:
+        return line.split()
+    else:
+        return line.split(delimiter)
+
+
+def parse_fields(spec):
+    '''
+    Parse a list of fields like ``1,3-5,7-``, into a list of ``(start, stop)``
+    slices of the fields of a line.
+    '''
+    ranges = []
+    for part in spec.split(','):
+        if '-' in part:
+            start, stop = part.split('-', 1)
+            start = int(start or 1)
+            stop = stop and int(stop) or None
+        else:
+            start = stop = int(part)
+        if start < 1 or (stop is not None and stop < start):
+            raise ValueError(part)
+        ranges.append((start - 1, stop))
+    return ranges
+
+
+def cut_lines(target, ranges, delimiter=None):
+    '''
+    Filter stage that passes on the selected ``ranges`` of fields of every
+    line, see :func:`parse_fields`.
+    '''
+    join = delimiter is None and ' ' or delimiter
+    while True:
+        fields = split_fields((yield), delimiter)
+        selected = []
+        for start, stop in ranges:
+            selected.extend(fields[start:stop])
+        target.send(join.join(selected))
+
+
+def number(text, default=None):
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            return default
+
+
+def sum_lines(target, field=1, delimiter=None):
+    '''
+    Filter stage that passes on the sum of the numbers in the given field of
+    all lines; lines without a number there are skipped.
+    '''
+    total = 0
+    try:
+        while True:
+            fields = split_fields((yield), delimiter)
+            if len(fields) >= field:
+                total += number(fields[field - 1], 0)
+    except GeneratorExit:
+        target.send(str(total))
+
+
+class Lines(object):
+    '''
+    Store of lines, kept as one string with an array of the offsets where
+    the lines end, so a large output does not cost a string object for
+    every line. Lines are sliced out of the string as they are needed.
+    '''
+
+    def __init__(self):
+        self.data = ''
+        self.blocks = []
+        self.ends = array('L')
+        self.size = 0
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, index):
+        if self.blocks:
+            self.data = ''.join([self.data] + self.blocks)
+            self.blocks = []
+        end = self.ends[index]
+        if index < 0:
+            index += len(self.ends)
+        if index:
+            return self.data[self.ends[index - 1] + 1:end]
+        else:
+            return self.data[:end]
+
+    def __iter__(self):
+        for index in xrange(len(self.ends)):
+            yield self[index]
+
+    def extend(self, block):
+        '''
+        Add a block of lines, separated by newlines.
+        '''
+        ends = self.ends
+        size = self.size
+        pos = block.find('\n')
+        while pos != -1:
+            ends.append(size + pos)
+            pos = block.find('\n', pos + 1)
+        ends.append(size + len(block))
+        self.blocks.append(block)
+        self.blocks.append('\n')
+        self.size += len(block) + 1
+
+    append = extend
+
+    def order(self, key=None, reverse=False):
+        '''
+        Returns the indices of the lines, sorted by the line or by ``key``
+        of the line.
+        '''
+        if key is None:
+            key = self.__getitem__
+        else:
+            keys = [key(line) for line in self]
+            key = keys.__getitem__
+        return sorted(xrange(len(self)), key=key, reverse=reverse)
+
+
+def sort_lines(target, key=None, reverse=False):
+    '''
+    Filter stage that passes on all lines sorted by the line or by ``key``
+    of the line, see :class:`Lines`.
+    '''
+    lines = Lines()
+    try:
+        while True:
+            lines.extend((yield))
+    except GeneratorExit:
+        for index in lines.order(key, reverse):
+            target.send(lines[index])
+
+sort_lines.blocks = True
+
 
 class Filter(Section):
-    RE_LINE = re.compile(r'(?:\r\n|\n)')
+    '''
+    Filters for the output of commands. Set ``processes`` to match lines in
+    that many child processes, for CPU heavy filtering of large outputs.
+    '''
+
+    processes = 0
 
     def __init__(self, interface):
         Section.__init__(self, None, interface=interface)
@@ -37,72 +515,197 @@ class Filter(Section):
             -i  Ignore case distinctions
             -v  Invert the sense of matching, to select non-matching lines
         '''
+        opts, argv = self._getopt(sink, 'grep', args, 'civ')
+        pattern = ' '.join(argv)
+        flags = '-i' in opts and re.I or 0
+        find = self._finder(sink, 'grep', pattern, flags)
+
+        if self.processes:
+            sink.pipe(offload_lines, grep_batch, (pattern, flags,
+                '-v' in opts), self.processes, name='grep')
+            if '-c' in opts:
+                sink.pipe(count_lines, name='grep')
+            return
+
+        sink.pipe(grep_block, find, '-v' in opts, '-c' in opts, name='grep')
+
+    @command
+    def inc(self, sink, *args):
+        sink.pipe(grep_block, finder(' '.join(args), literal=True),
+            name='inc')
+
+    @command
+    def exc(self, sink, *args):
+        sink.pipe(grep_block, finder(' '.join(args), literal=True), True,
+            name='exc')
+
+    include = inc
+    exclude = exc
+
+    def _getopt(self, sink, name, args, options):
         try:
-            opts, argv = getopt.getopt(args, 'civ')
-            opts = dict(opts)
+            opts, argv = getopt.getopt(args, options)
+            return dict(opts), argv
         except getopt.GetoptError, error:
-            sink.stdout.flush()
-            sink.error(''.join(['grep: ', str(error), '\r\n']))
+            sink.error(''.join([name, ': ', str(error), '\r\n']))
             raise StopIteration
 
+    def _number(self, sink, name, value):
         try:
-            if '-i' in opts:
-                patt = re.compile(' '.join(argv), re.I)
-            else:
-                patt = re.compile(' '.join(argv))
+            value = int(value)
+        except ValueError:
+            value = -1
+        if value < 0:
+            sink.error(name + ': invalid numeric value\r\n')
+            raise StopIteration
+        return value
+
+    def _finder(self, sink, name, pattern, flags=0):
+        try:
+            return finder(pattern, flags)
         except Exception, error:
-            sink.stdout.flush()
-            sink.error(''.join(['grep: ', str(error), '\r\n']))
+            sink.error(''.join([name, ': ', str(error), '\r\n']))
             raise StopIteration
 
-        if '-v' in opts:
-            test = lambda line: not patt.match(line)
-        else:
-            test = lambda line: patt.match(line)
+    @command
+    def head(self, sink, *args):
+        '''
+        syntax:  head [-n <count>]
+        example: head -n 5
 
-        output = []
-        for line in self.RE_LINE.split(str(sink.stdout)):
-            if test(line):
-                output.append(''.join([line, '\r\n']))
+        Show the first lines of the output, 10 by default.
+        '''
+        opts, argv = self._getopt(sink, 'head', args, 'n:')
+        count = self._number(sink, 'head', opts.get('-n', 10))
+        sink.pipe(head_lines, count, name='head')
+
+    @command
+    def tail(self, sink, *args):
+        '''
+        syntax:  tail [-n <count>]
+        example: tail -n 5
+
+        Show the last lines of the output, 10 by default.
+        '''
+        opts, argv = self._getopt(sink, 'tail', args, 'n:')
+        count = self._number(sink, 'tail', opts.get('-n', 10))
+        sink.pipe(tail_lines, count, name='tail')
+
+    @command
+    def count(self, sink, *args):
+        '''
+        syntax:  count [<pattern>]
+        example: count interface
 
-        if '-c' in opts:
-            sink.stdout = '%d\r\n' % (len(output),)
+        Show the number of lines, or the number of lines matching the
+        pattern.
+        '''
+        if args:
+            find = self._finder(sink, 'count', ' '.join(args))
+            sink.pipe(grep_block, find, False, True, name='count')
         else:
-            sink.stdout = ''.join(output)
+            sink.pipe(count_lines, name='count')
 
     @command
-    def inc(self, sink, *args):
-        return self.grep(sink, re.escape(' '.join(args)))
+    def sort(self, sink, *args):
+        '''
+        syntax:  sort [<options>]
+        example: sort -n -r -k 2
+
+        options:
+            -k  Sort on the given field instead of the whole line
+            -n  Compare numeric values
+            -r  Reverse the result of comparisons
+            -t  Use the given field separator instead of white space
+        '''
+        opts, argv = self._getopt(sink, 'sort', args, 'k:nrt:')
+        delimiter = opts.get('-t')
+        if '-k' in opts:
+            field = self._number(sink, 'sort', opts['-k']) - 1
+            if field < 0:
+                sink.error('sort: invalid field\r\n')
+                raise StopIteration
+            def text(line):
+                fields = split_fields(line, delimiter)
+                return len(fields) > field and fields[field] or ''
+        else:
+            text = None
+
+        if '-n' in opts:
+            if text is None:
+                text = lambda line: line.strip().split(' ', 1)[0]
+            key = lambda line: number(text(line), 0)
+        else:
+            key = text
+
+        sink.pipe(sort_lines, key, '-r' in opts, name='sort')
 
     @command
-    def exc(self, sink, *args):
-        return self.grep(sink, '-v', re.escape(' '.join(args)))
+    def uniq(self, sink, *args):
+        '''
+        syntax:  uniq [-c]
+        example: sort | uniq -c
 
-    include = inc
-    exclude = exc
+        Show one of every run of equal lines.
+
+        options:
+            -c  Prefix lines by the number of occurrences
+        '''
+        opts, argv = self._getopt(sink, 'uniq', args, 'c')
+        sink.pipe(uniq_lines, '-c' in opts, name='uniq')
 
     @command
-    def head(self, sink, *args):
+    def cut(self, sink, *args):
+        '''
+        syntax:  cut -f <fields> [-d <delimiter>]
+        example: cut -f 1,3-5
+
+        Show only the selected fields of every line, fields are separated by
+        white space unless a delimiter is given.
+        '''
+        opts, argv = self._getopt(sink, 'cut', args, 'd:f:')
         try:
-            opts, argv = getopt.getopt(args, 'n:')
-            opts = dict(opts)
-        except getopt.GetoptError, error:
-            sink.stdout.flush()
-            sink.error(''.join(['head: ', str(error), '\r\n']))
+            ranges = parse_fields(opts['-f'])
+        except (KeyError, ValueError):
+            sink.error('cut: invalid field list\r\n')
             raise StopIteration
+        sink.pipe(cut_lines, ranges, opts.get('-d'), name='cut')
 
-        try:
-            count = int(opts['n'])
-        except ValueError:
-            sink.stdout.flush()
-            sink.error('head: invalud numeric value')
+    @command
+    def sum(self, sink, *args):
+        '''
+        syntax:  sum [-f <field>] [-d <delimiter>]
+        example: sum -f 3
+
+        Show the sum of the numbers in a field of all lines, the first field
+        by default.
+        '''
+        opts, argv = self._getopt(sink, 'sum', args, 'd:f:')
+        field = self._number(sink, 'sum', opts.get('-f', 1))
+        if field < 1:
+            sink.error('sum: invalid field\r\n')
             raise StopIteration
+        sink.pipe(sum_lines, field, opts.get('-d'), name='sum')
 
-        lines = self.RE_LINE.split(str(sink.stdout))
-        sink.stdout.flush()
-        for i, line in enumerate(lines):
-            if i < count:
-                sink.write(''.join([line, '\r\n']))
-            else:
-                break
+    @command
+    def begin(self, sink, *args):
+        '''
+        syntax:  begin <pattern>
+        example: begin interface
+
+        Show the output from the first line matching the pattern.
+        '''
+        find = self._finder(sink, 'begin', ' '.join(args))
+        sink.pipe(begin_lines, find, name='begin')
 
+    @command
+    def section(self, sink, *args):
+        '''
+        syntax:  section <pattern>
+        example: section interface
+
+        Show the lines matching the pattern that are not indented, each
+        followed by the indented lines under it.
+        '''
+        find = self._finder(sink, 'section', ' '.join(args))
+        sink.pipe(section_lines, find, name='section')
@@ -16,15 +16,31 @@ __copyright__ = '(C) 2010 Wijnand Modderman-Lenstra'
 __license__   = 'MIT'
 __url__       = 'http://code.maze.io/'
 
+from array import array
+from bisect import bisect_left, bisect_right
+import mmap
+import os
+import threading
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
-class History(list):
-    def __init__(self, *args):
-        super(History, self).__init__(*args)
-        self.position = -1
+NGRAM = 3
 
-    def append(self, *args):
-        super(History, self).append(*args)
-        self.reset()
+
+def ngrams(line):
+    '''
+    Returns the set of n-grams in the line.
+    '''
+    return set([line[i:i + NGRAM] for i in xrange(len(line) - NGRAM + 1)])
+
+
+class Cursor(object):
+    '''
+    Browse through the lines of a history, the ``position`` is the number of
+    the current line.
+    '''
 
     def reset(self):
         self.position = len(self) - 1
@@ -41,27 +57,554 @@ class History(list):
         return self.current()
 
     def complete_backward(self, item):
-        for line in iter(reversed(self)):
-            if item in line:
-                return line
+        number = self.search_backward(item)
+        if number is not None:
+            return self[number]
 
     def complete_forward(self, item):
-        for line in iter(self):
-            if item in line:
-                return line
+        number = self.search_forward(item)
+        if number is not None:
+            return self[number]
+
+
+class History(Cursor, list):
+    '''
+    Command history, with an n-gram index to search for the lines containing
+    a substring. The index maps every n-gram to the sorted numbers of the
+    lines it appears in, and is updated on :meth:`append`.
+    '''
+
+    # number of the oldest line kept in memory
+    base = 0
+
+    def __init__(self, *args):
+        super(History, self).__init__(*args)
+        self.position = -1
+        self.index = {}
+        for number, line in enumerate(self):
+            self.index_line(number, line)
+
+    def append(self, *args):
+        super(History, self).append(*args)
+        self.index_line(len(self) - 1, self[-1])
+        self.reset()
+
+    def index_line(self, number, line):
+        index = self.index
+        for ngram in ngrams(line):
+            numbers = index.get(ngram)
+            if numbers is None:
+                index[ngram] = [number]
+            else:
+                numbers.append(number)
+
+    def candidates(self, item):
+        '''
+        Returns the sorted numbers of the lines that may contain ``item``,
+        that is the shortest list of lines sharing an n-gram with it.
+        '''
+        if len(item) < NGRAM:
+            return xrange(self.base, len(self))
+
+        best = None
+        for ngram in ngrams(item):
+            numbers = self.index.get(ngram)
+            if numbers is None:
+                return []
+            elif best is None or len(numbers) < len(best):
+                best = numbers
+        return best
+
+    def search_backward(self, item, position=None):
+        '''
+        Returns the number of the last line at or before ``position`` that
+        contains ``item``, or ``None`` if there is no such line.
+        '''
+        if position is None:
+            position = len(self) - 1
+        candidates = self.candidates(item)
+        for i in xrange(bisect_right(candidates, position) - 1, -1, -1):
+            number = candidates[i]
+            if item in self[number]:
+                return number
+
+    def search_forward(self, item, position=0):
+        '''
+        Returns the number of the first line at or after ``position`` that
+        contains ``item``, or ``None`` if there is no such line.
+        '''
+        candidates = self.candidates(item)
+        for i in xrange(bisect_left(candidates, position), len(candidates)):
+            number = candidates[i]
+            if item in self[number]:
+                return number
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class UniqueHistory(Cursor):
+    '''
+    Command history that keeps every line once; a line that is appended
+    again moves to the end. The lines are numbered from oldest to newest,
+    like those of a :class:`History`.
+
+    Every line is kept under a ``stamp``, that increases with every append,
+    and the n-gram index maps to the stamps, so moving a line to the end
+    does not renumber the other lines in the index.
+    '''
+
+    def __init__(self, lines=()):
+        self.position = -1
+        self.stamp = 0
+        # stamps of the lines, oldest first
+        self.stamps = []
+        self.lines = {}
+        self.stamped = {}
+        self.index = {}
+        for line in lines:
+            self.append(line)
+
+    def __len__(self):
+        return len(self.stamps)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self.lines[stamp] for stamp in self.stamps[item]]
+        return self.lines[self.stamps[item]]
+
+    def __getslice__(self, start, end):
+        return self[max(0, start):max(0, end):1]
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def append(self, line):
+        stamp = self.stamped.get(line)
+        if stamp is not None:
+            if stamp == self.stamps[-1]:
+                # repeats the last line
+                self.reset()
+                return
+            del self.stamps[bisect_left(self.stamps, stamp)]
+            del self.lines[stamp]
+            for ngram in ngrams(line):
+                stamps = self.index[ngram]
+                del stamps[bisect_left(stamps, stamp)]
+
+        self.stamp += 1
+        stamp = self.stamp
+        self.stamps.append(stamp)
+        self.lines[stamp] = line
+        self.stamped[line] = stamp
+        index = self.index
+        for ngram in ngrams(line):
+            stamps = index.get(ngram)
+            if stamps is None:
+                index[ngram] = [stamp]
+            else:
+                stamps.append(stamp)
+        self.reset()
+
+    def candidates(self, item):
+        '''
+        Returns the sorted stamps of the lines that may contain ``item``,
+        see :meth:`History.candidates`.
+        '''
+        if len(item) < NGRAM:
+            return self.stamps
+
+        best = None
+        for ngram in ngrams(item):
+            stamps = self.index.get(ngram)
+            if not stamps:
+                return []
+            elif best is None or len(stamps) < len(best):
+                best = stamps
+        return best
+
+    def search_backward(self, item, position=None):
+        '''
+        Returns the number of the last line at or before ``position`` that
+        contains ``item``, or ``None`` if there is no such line.
+        '''
+        if position is None or position >= len(self):
+            position = len(self) - 1
+        if position < 0:
+            return None
+        candidates = self.candidates(item)
+        for i in xrange(bisect_right(candidates, self.stamps[position]) - 1,
+            -1, -1):
+            stamp = candidates[i]
+            if item in self.lines[stamp]:
+                return bisect_left(self.stamps, stamp)
+
+    def search_forward(self, item, position=0):
+        '''
+        Returns the number of the first line at or after ``position`` that
+        contains ``item``, or ``None`` if there is no such line.
+        '''
+        position = max(0, position)
+        if position >= len(self):
+            return None
+        candidates = self.candidates(item)
+        for i in xrange(bisect_left(candidates, self.stamps[position]),
+            len(candidates)):
+            stamp = candidates[i]
+            if item in self.lines[stamp]:
+                return bisect_left(self.stamps, stamp)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SharedHistory(object):
+    '''
+    History shared by many sessions, that may append to it from different
+    threads. Every session browses the shared lines with its own
+    :class:`HistoryCursor`, see :meth:`cursor`.
+
+    The lines are kept in a single ``store``, a :class:`UniqueHistory`
+    unless another one (such as a :class:`HistoryFile`) is given. A command
+    that is repeated by many sessions is kept and indexed once, so memory
+    grows with the distinct commands rather than with the sessions. Lines
+    are interned, and a line that repeats the last line is not stored
+    again by any store.
+    '''
+
+    def __init__(self, store=None):
+        if store is None:
+            store = UniqueHistory()
+        self.store = store
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.store)
+
+    def cursor(self):
+        return HistoryCursor(self)
+
+    def append(self, line):
+        if isinstance(line, str):
+            line = intern(line)
+        self.lock.acquire()
+        try:
+            if not len(self.store) or self.store[-1] != line:
+                self.store.append(line)
+        finally:
+            self.lock.release()
+
+    def get(self, item):
+        self.lock.acquire()
+        try:
+            return self.store[item]
+        finally:
+            self.lock.release()
+
+    def search_backward(self, item, position=None):
+        self.lock.acquire()
+        try:
+            return self.store.search_backward(item, position)
+        finally:
+            self.lock.release()
+
+    def search_forward(self, item, position=0):
+        self.lock.acquire()
+        try:
+            return self.store.search_forward(item, position)
+        finally:
+            self.lock.release()
+
+    def flush(self):
+        self.lock.acquire()
+        try:
+            self.store.flush()
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            self.store.close()
+        finally:
+            self.lock.release()
+
+
+class HistoryCursor(Cursor):
+    '''
+    A session's view on a :class:`SharedHistory`, with its own position.
+    '''
+
+    def __init__(self, shared):
+        self.shared = shared
+        self.reset()
+
+    def __len__(self):
+        return len(self.shared)
+
+    def __getitem__(self, item):
+        return self.shared.get(item)
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def append(self, line):
+        self.shared.append(line)
+        self.reset()
+
+    def search_backward(self, item, position=None):
+        return self.shared.search_backward(item, position)
+
+    def search_forward(self, item, position=0):
+        return self.shared.search_forward(item, position)
+
+    def flush(self):
+        self.shared.flush()
+
+    def close(self):
+        # the shared history outlives the sessions
+        self.shared.flush()
 
 
 class HistoryFile(History):
+    '''
+    History kept in an append-only file, that may be shared by many sessions
+    and processes.
+
+    Only the last ``window`` to ``2 * window`` lines are kept in memory,
+    older lines are paged in from a memory map of the file when needed.
+    Appended lines are written in batches of ``batch_size`` lines, and
+    synced to disk if ``sync`` is set. Once the file grows beyond ``limit``
+    lines it is compacted, removing duplicate lines and keeping the last
+    ``limit`` lines at most.
+
+    When the in-memory window is full, it is reloaded from the tail of the
+    file, which also picks up the lines written by other sessions.
+    '''
+
+    window = 1000
+    batch_size = 1
+    sync = False
+    limit = 100000
+
     def __init__(self, filename, mode='a'):
         self.filename = filename
+        self.map = None
+        self.offsets = array('L', [0])
+        self.pending = []
+        self.lock_handle = None
+        History.__init__(self)
+
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+        if 'w' in mode:
+            flags |= os.O_TRUNC
+        self.handle = os.open(filename, flags, 0600)
         self.load()
-        self.handle = open(filename, mode)
 
-    def load(self):
-        for line in file(self.filename):
-            super(History, self).append(line.strip())
+    def __len__(self):
+        return self.base + list.__len__(self)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[number] for number in xrange(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if item < 0 or item >= len(self):
+            raise IndexError('history index out of range')
+        elif item >= self.base:
+            return list.__getitem__(self, item - self.base)
+        else:
+            return self.line(item)
+
+    def __getslice__(self, start, end):
+        return self[max(0, start):max(0, end):1]
+
+    def __iter__(self):
+        for number in xrange(len(self)):
+            yield self[number]
+
+    def __reversed__(self):
+        for number in xrange(len(self) - 1, -1, -1):
+            yield self[number]
+
+    def line(self, number):
+        '''
+        Read a line from the file.
+        '''
+        return self.map[self.offsets[number]:self.offsets[number + 1]].rstrip(
+            '\r\n')
+
+    def load(self, compact=True):
+        '''
+        Map the file, keep the offsets of the older lines and load the last
+        ``window`` lines in memory.
+        '''
+        handle = open(self.filename, 'rb')
+        try:
+            size = os.fstat(handle.fileno()).st_size
+            if size:
+                data = mmap.mmap(handle.fileno(), size, access=mmap.ACCESS_READ)
+            else:
+                data = ''
+        finally:
+            handle.close()
+
+        offsets = array('L', [0])
+        offset = data.find('\n')
+        while offset != -1:
+            offsets.append(offset + 1)
+            offset = data.find('\n', offset + 1)
+        if offsets[-1] != size:
+            # last line is not terminated, maybe it is still being written
+            offsets.append(size)
+        lines = len(offsets) - 1
+
+        if compact and self.limit and lines > self.limit:
+            return self.compact()
+
+        base = max(0, lines - self.window)
+        self.map = data
+        self.offsets = offsets
+        window = [self.line(number) for number in xrange(base, lines)]
+
+        del self.offsets[base + 1:]
+        self.base = base
+        list.__delslice__(self, 0, list.__len__(self))
+        list.extend(self, window)
+        self.index = {}
+        for number in xrange(base, len(self)):
+            self.index_line(number, self[number])
+        self.reset()
+
+    def page(self):
+        '''
+        Write out pending lines, and reload the window from the file.
+        '''
+        self.flush()
+        self.load()
+
+    def compact(self):
+        '''
+        Rewrite the file, keeping only the last occurrence of every line and
+        no more than ``limit`` lines.
+        '''
+        self.lock()
+        try:
+            self.flush(locked=True)
+            lines = []
+            seen = set()
+            for line in reversed(file(self.filename).read().splitlines()):
+                if line and line not in seen:
+                    seen.add(line)
+                    lines.append(line)
+                    if len(lines) == self.limit:
+                        break
+            lines.reverse()
+
+            temp = '.'.join([self.filename, 'tmp'])
+            handle = open(temp, 'wb')
+            try:
+                handle.write(''.join([line + '\n' for line in lines]))
+                handle.flush()
+                os.fsync(handle.fileno())
+            finally:
+                handle.close()
+            os.chmod(temp, 0600)
+            os.rename(temp, self.filename)
+        finally:
+            self.unlock()
+        self.load(compact=False)
+
+    def lock(self):
+        if fcntl is None:
+            return
+        if self.lock_handle is None:
+            self.lock_handle = open('.'.join([self.filename, 'lock']), 'a')
+        fcntl.flock(self.lock_handle.fileno(), fcntl.LOCK_EX)
+
+    def unlock(self):
+        if self.lock_handle is not None:
+            fcntl.flock(self.lock_handle.fileno(), fcntl.LOCK_UN)
+
+    def reopen(self):
+        '''
+        Reopen the file if it was replaced by another process compacting it.
+        '''
+        try:
+            replaced = os.stat(self.filename).st_ino != \
+                os.fstat(self.handle).st_ino
+        except OSError:
+            replaced = True
+        if replaced:
+            os.close(self.handle)
+            self.handle = os.open(self.filename,
+                os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0600)
+
+    def search_backward(self, item, position=None):
+        if position is None:
+            position = len(self) - 1
+        number = History.search_backward(self, item, position)
+        if number is None and self.base and position >= 0:
+            # search the older lines in the file
+            end = self.offsets[min(position + 1, self.base)]
+            if not item:
+                return min(position, self.base - 1)
+            found = self.map.rfind(item, 0, end)
+            if found != -1:
+                number = bisect_right(self.offsets, found) - 1
+        return number
+
+    def search_forward(self, item, position=0):
+        position = max(0, position)
+        if position < self.base:
+            # search the older lines in the file first
+            if not item:
+                return position
+            found = self.map.find(item, self.offsets[position],
+                self.offsets[self.base])
+            if found != -1:
+                return bisect_right(self.offsets, found) - 1
+        return History.search_forward(self, item, position)
 
     def append(self, line):
-        super(History, self).append(line)
-        self.handle.write(''.join([line, '\n']))
-        self.handle.flush()
+        History.append(self, line)
+        self.pending.append(line)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        if list.__len__(self) >= 2 * self.window:
+            self.page()
+
+    def flush(self, locked=False):
+        '''
+        Write the pending lines to the file.
+        '''
+        if not self.pending:
+            return
+        data = ''.join([line + '\n' for line in self.pending])
+        self.pending = []
+        if not locked:
+            self.lock()
+        try:
+            self.reopen()
+            while data:
+                data = data[os.write(self.handle, data):]
+            if self.sync:
+                os.fsync(self.handle)
+        finally:
+            if not locked:
+                self.unlock()
+
+    def close(self):
+        self.flush()
+        if self.handle is not None:
+            os.close(self.handle)
+            self.handle = None
+        if self.lock_handle is not None:
+            self.lock_handle.close()
+            self.lock_handle = None
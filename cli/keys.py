@@ -0,0 +1,200 @@
+#! /usr/bin/env python
+#
+#                         _______
+#   ____________ _______ _\__   /_________       ___  _____
+#  |    _   _   \   _   |   ____\   _    /      |   |/  _  \
+#  |    /   /   /   /   |  |     |  /___/   _   |   |   /  /
+#  |___/___/   /___/____|________|___   |  |_|  |___|_____/
+#          \__/                     |___|
+#
+#
+# (c) 2010 Wijnand 'maze' Modderman-Lenstra - http://maze.io/
+#
+
+__author__    = 'Wijnand Modderman-Lenstra <maze@pyth0n.org>'
+__copyright__ = '(C) 2010 Wijnand Modderman-Lenstra'
+__license__   = 'MIT'
+__url__       = 'http://code.maze.io/'
+
+import re
+import time
+
+# runs of printable characters, except for "?" which has a meaning of its own
+RE_TEXT = re.compile(r'[\x20-\x3e\x40-\x7e]+')
+# generic CSI, SS3 and meta sequences, used to skip unknown sequences
+RE_SEQUENCE = re.compile(r'''
+    \x1b(?:
+        \x5b[\x30-\x3f]*[\x20-\x2f]*[\x40-\x7e] |   # CSI
+        \x4f[\x20-\x7e] |                           # SS3
+        [\x20-\x4e\x50-\x5a\x5c-\x7e]               # meta
+    )''', re.X)
+RE_PARTIAL = re.compile(r'\x1b(?:\x5b[\x30-\x3f]*[\x20-\x2f]*|\x4f)?\Z')
+
+# xterm modifier parameters
+MODIFIERS = {
+    2: 'shift',
+    3: 'alt',
+    4: 'alt-shift',
+    5: 'ctrl',
+    6: 'ctrl-shift',
+    7: 'ctrl-alt',
+    8: 'ctrl-alt-shift',
+}
+
+
+def expand(sequence):
+    '''
+    Add the xterm modifier variants of all CSI and SS3 sequences in the
+    given sequence table, for example ``ctrl-left`` for ``left``.
+    '''
+    names = dict(sequence)
+    for code, name in sequence.iteritems():
+        if not code.startswith(('\x1b\x5b', '\x1b\x4f')) or len(code) < 3:
+            continue
+
+        # CSI 1 ; <modifier> <final> and CSI <number> ; <modifier> ~
+        if code[-1] == '\x7e' and code[2:-1].isdigit():
+            fmt = '\x1b\x5b%s;%%d\x7e' % (code[2:-1],)
+        elif len(code) == 3 and code[2].isalpha():
+            fmt = '\x1b\x5b1;%%d%s' % (code[2],)
+        else:
+            continue
+
+        for modifier, prefix in MODIFIERS.iteritems():
+            names.setdefault(fmt % (modifier,), '-'.join([prefix, name]))
+
+    return names
+
+
+def compile(sequence):
+    '''
+    Build a prefix trie of all escape sequences in the sequence table, each
+    node maps the next character to a child node; ``None`` maps to the
+    name of the key if the node completes a sequence.
+    '''
+    trie = {}
+    for code, name in sequence.iteritems():
+        if not code.startswith('\x1b'):
+            continue
+        node = trie
+        for char in code:
+            node = node.setdefault(char, {})
+        node[None] = name
+    return trie
+
+
+class Decoder(object):
+    '''
+    Incremental key decoder, turns chunks of input into key events.
+
+    A key event is either a single control character, a complete escape
+    sequence or a run of printable characters. Escape sequences are
+    resolved with a prefix trie built from the sequence table; sequences
+    that are split over multiple chunks are kept until they are complete,
+    or until :attr:`timeout` seconds passed (see :meth:`expire`).
+
+        >>> decoder = Decoder({'\\x1b[D': 'left'})
+        >>> decoder.feed('ls\\x1b[')
+        ['ls']
+        >>> decoder.feed('D\\r')
+        ['\\x1b[D', '\\r']
+    '''
+
+    timeout = 0.05
+
+    def __init__(self, sequence=None):
+        self.names = expand(sequence or {})
+        self.trie = compile(self.names)
+        self.pending = ''
+        self.started = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    @property
+    def deadline(self):
+        if self.pending:
+            return self.started + self.timeout
+
+    def lookup(self, sequence):
+        '''
+        Get the name of a key sequence, or ``None`` if it is unknown.
+        '''
+        return self.names.get(sequence)
+
+    def feed(self, data, force=False):
+        started = None
+        if self.pending:
+            data = self.pending + data
+            self.pending = ''
+            started = self.started
+
+        keys = []
+        offset = 0
+        size = len(data)
+        while offset < size:
+            match = RE_TEXT.match(data, offset)
+            if match:
+                keys.append(match.group())
+                offset = match.end()
+
+            elif data[offset] == '\x1b':
+                end = self.sequence(data, offset, force)
+                if end is None:
+                    self.pending = data[offset:]
+                    if offset or started is None:
+                        started = time.time()
+                    self.started = started
+                    break
+                keys.append(data[offset:end])
+                offset = end
+
+            else:
+                keys.append(data[offset])
+                offset += 1
+
+        return keys
+
+    def expire(self, now=None):
+        '''
+        Resolve a partial sequence that has been pending for longer than
+        :attr:`timeout` seconds, for example a single escape key press.
+        '''
+        if not self.pending:
+            return []
+        if (now or time.time()) < self.deadline:
+            return []
+        return self.feed('', force=True)
+
+    def sequence(self, data, offset, force=False):
+        '''
+        Find the end of the escape sequence starting at ``offset``, returns
+        ``None`` if the sequence is not complete yet.
+        '''
+        node = self.trie
+        end = offset
+        size = len(data)
+        last = None
+        while end < size:
+            node = node.get(data[end])
+            if node is None:
+                break
+            end += 1
+            if None in node:
+                # a complete sequence, that is not a prefix of another one
+                if len(node) == 1:
+                    return end
+                last = end
+
+        else:
+            if not force:
+                return None
+            return last or size
+
+        # not in our table, skip over the complete sequence
+        match = RE_SEQUENCE.match(data, offset)
+        if match:
+            return match.end()
+        elif not force and RE_PARTIAL.match(data, offset):
+            return None
+        return last or offset + 1
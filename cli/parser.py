@@ -16,11 +16,45 @@ __copyright__ = '(C) 2010 Wijnand Modderman-Lenstra'
 __license__   = 'MIT'
 __url__       = 'http://code.maze.io/'
 
+import re
 import shlex
 
+# characters that make up a word, the same as for shlex in posix mode with the
+# extra word characters we allow
+WORDCHARS = ''.join([
+    'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_',
+    ''.join(map(chr, range(0xc0, 0xd7) + range(0xd8, 0xf7) + range(0xf8, 0x100))),
+    ',./[]{}~!@$%^&*()-_=+:;',
+])
+RE_TOKEN = re.compile(r"""
+    (?P<space>[ \t\r\n]+)
+  | (?P<comment>\#[^\n]*)
+  | (?P<word>(?:[%s]+|'[^']*'|"(?:[^"\\]|\\.)*"|\\.)+)
+  | (?P<quote>['"])
+  | (?P<escape>\\)
+  | (?P<char>.)
+""" % (re.escape(WORDCHARS),), re.S | re.X)
+RE_WORD_PART = re.compile(r"""
+    ([^'"\\]+)
+  | '([^']*)'
+  | "((?:[^"\\]|\\.)*)"
+  | \\(.)
+""", re.S | re.X)
+RE_QUOTED_ESCAPE = re.compile(r'\\(["\\])')
+
+
+class ParseError(ValueError):
+    def __init__(self, message, position):
+        ValueError.__init__(self, '%s at position %d' % (message, position))
+        self.message = message
+        self.position = position
+
 
 class Token(str):
-    pass
+    def __new__(cls, value, position=None):
+        token = str.__new__(cls, value)
+        token.position = position
+        return token
 
 
 class TokenPipe(Token):
@@ -35,7 +69,60 @@ class TokenWord(Token):
     pass
 
 
+def unquote(word):
+    '''
+    Remove the quotes and escapes from a word.
+    '''
+    part = []
+    for plain, single, double, escaped in RE_WORD_PART.findall(word):
+        if double:
+            part.append(RE_QUOTED_ESCAPE.sub(r'\1', double))
+        else:
+            part.append(plain or single or escaped)
+    return ''.join(part)
+
+
 def parse(line, posix=True):
+    '''
+    Split the line into tokens, with the same quoting rules as
+    :mod:`shlex` in posix mode. Tokens have a ``position`` attribute with
+    the offset of the token in the line. Raises :class:`ParseError` if a
+    quote is not closed or an escape is not followed by a character.
+
+    Unlike :mod:`shlex`, an empty quoted string is an empty word and does
+    not end the line.
+    '''
+    if not posix:
+        for token in parse_shlex(line, posix):
+            yield token
+        return
+
+    for match in RE_TOKEN.finditer(line):
+        kind = match.lastgroup
+        token = match.group()
+        if kind == 'word':
+            if '"' in token or "'" in token or '\\' in token:
+                token = unquote(token)
+        elif kind == 'char':
+            pass
+        elif kind == 'quote':
+            raise ParseError('no closing quotation', match.start())
+        elif kind == 'escape':
+            raise ParseError('no escaped character', match.start())
+        else:
+            continue
+
+        if token == '|':
+            yield TokenPipe(token, match.start())
+
+        elif token in ['<', '>']:
+            yield TokenRedirect(token, match.start())
+
+        else:
+            yield TokenWord(token, match.start())
+
+
+def parse_shlex(line, posix=True):
     lexer = shlex.shlex(line, posix=posix)
     lexer.wordchars += ',./[]{}~!@$%^&*()-_=+:;'
 
@@ -0,0 +1,163 @@
+#! /usr/bin/env python
+#
+#                         _______
+#   ____________ _______ _\__   /_________       ___  _____
+#  |    _   _   \   _   |   ____\   _    /      |   |/  _  \
+#  |    /   /   /   /   |  |     |  /___/   _   |   |   /  /
+#  |___/___/   /___/____|________|___   |  |_|  |___|_____/
+#          \__/                     |___|
+#
+#
+# (c) 2010 Wijnand 'maze' Modderman-Lenstra - http://maze.io/
+#
+
+__author__    = 'Wijnand Modderman-Lenstra <maze@pyth0n.org>'
+__copyright__ = '(C) 2010 Wijnand Modderman-Lenstra'
+__license__   = 'MIT'
+__url__       = 'http://code.maze.io/'
+
+CSI = '\x1b\x5b'
+ERASE_LINE = CSI + 'K'
+
+
+def cursor_left(count):
+    if count <= 3:
+        return '\b' * count
+    return '%s%dD' % (CSI, count)
+
+
+def cursor_right(count):
+    return '%s%dC' % (CSI, count)
+
+
+def insert_chars(count):
+    return '%s%d@' % (CSI, count)
+
+
+def delete_chars(count):
+    return '%s%dP' % (CSI, count)
+
+
+def common_prefix(a, b):
+    size = min(len(a), len(b))
+    if a[:size] == b[:size]:
+        return size
+    lo, hi = 0, size
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def common_suffix(a, b, limit):
+    size = min(len(a), len(b), limit)
+    lo, hi = 0, size
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:] == b[len(b) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+class Line(object):
+    '''
+    Keep track of the input line as it is shown on the terminal, and
+    compute the minimal update to show a new line.
+
+    If we do not know what the terminal shows, for example because other
+    output was sent, the line is repainted completely.
+    '''
+
+    def __init__(self):
+        self.invalidate()
+
+    def invalidate(self):
+        self.prompt = None
+        self.buffer = ''
+        self.linepos = 0
+
+    def reset(self, prompt):
+        '''
+        The terminal shows just the prompt, followed by the cursor.
+        '''
+        self.prompt = prompt
+        self.buffer = ''
+        self.linepos = 0
+
+    def update(self, prompt, buffer, linepos):
+        '''
+        Returns the data to send to the terminal to show ``prompt`` and
+        ``buffer``, with the cursor at ``linepos`` in the buffer.
+        '''
+        if prompt != self.prompt:
+            data, cursor = self.repaint(prompt, buffer)
+        else:
+            data, cursor = self.change(buffer)
+
+        data.append(self.move(cursor, linepos, buffer))
+        self.prompt = prompt
+        self.buffer = buffer
+        self.linepos = linepos
+        return ''.join(data)
+
+    def repaint(self, prompt, buffer):
+        return ['\r', prompt, buffer, ERASE_LINE], len(buffer)
+
+    def change(self, buffer):
+        '''
+        Returns the data to change the shown buffer into the given buffer,
+        and the position of the cursor afterwards.
+        '''
+        shown = self.buffer
+        if shown == buffer:
+            return [], self.linepos
+
+        head = common_prefix(shown, buffer)
+        tail = common_suffix(shown, buffer, min(len(shown), len(buffer)) - head)
+        old = shown[head:len(shown) - tail]
+        new = buffer[head:len(buffer) - tail]
+        data = [self.move(self.linepos, head, buffer)]
+
+        if tail and len(new) == len(old):
+            # same length, overwrite the changed characters only
+            data.append(new)
+            return data, head + len(new)
+
+        # rewrite the tail of the line
+        rewrite = [new, buffer[len(buffer) - tail:]]
+        if len(shown) > len(buffer):
+            rewrite.append(ERASE_LINE)
+
+        if tail:
+            # or only insert/delete the characters that changed
+            if len(new) > len(old):
+                edit = [new[:len(old)], insert_chars(len(new) - len(old)),
+                    new[len(old):]]
+            else:
+                edit = [new, delete_chars(len(old) - len(new))]
+
+            if len(''.join(edit)) < len(''.join(rewrite)):
+                data.extend(edit)
+                return data, head + len(new)
+
+        data.extend(rewrite)
+        return data, len(buffer)
+
+    def move(self, start, end, buffer):
+        '''
+        Move the cursor in the given buffer from ``start`` to ``end``.
+        '''
+        if end < start:
+            return cursor_left(start - end)
+        elif end > start:
+            # writing the characters may be shorter than moving the cursor
+            move = cursor_right(end - start)
+            if len(move) < end - start:
+                return move
+            return buffer[start:end]
+        return ''
@@ -16,11 +16,21 @@ __copyright__ = '(C) 2010 Wijnand Modderman-Lenstra'
 __license__   = 'MIT'
 __url__       = 'http://code.maze.io/'
 
+from bisect import bisect_left, insort
 from functools import wraps
+import cProfile
+import getopt
+import inspect
+import os
+import pstats
 import textwrap
 import sys
 import re
-import traceback
+from types import GeneratorType
+from cli.executor import Job, call_in_process
+from cli.parser import parse
+from cli.sink import BrokenPipe, Sink
+from cli.stats import stats
 try:
     from cStringIO import StringIO
 except ImportError:
@@ -28,41 +38,170 @@ except ImportError:
 
 RE_SPACING = re.compile(r'\s+')
 
-def command(func):
+def command(func=None, offload=None, raw=False):
+    '''
+    Mark a method as a command. With ``offload='thread'`` the command runs
+    in a worker thread, see :meth:`Section.offload`. CPU bound commands may
+    use ``offload='process'`` to run in a child process instead, so they do
+    not hold the interpreter lock of the server; their output is passed on
+    in batches::
+
+        @command(offload='thread')
+        def ping(self, sink, host):
+            ...
+
+    A ``raw`` command is passed the rest of the command line as a single
+    argument, as it was typed, pipes included.
+    '''
+    if func is None:
+        return lambda func: command(func, offload, raw)
+
     @wraps(func)
     def decorated(*args, **kwargs):
         return func(*args, **kwargs)
 
     decorated.is_method = True
+    decorated.offload = offload
+    decorated.raw = raw
+    decorated.coroutine = inspect.isgeneratorfunction(func)
     return decorated
 
 
+def startswith(names, prefix):
+    '''
+    Returns the names in the sorted sequence ``names`` that start with
+    ``prefix``.
+    '''
+    start = bisect_left(names, prefix)
+    end = bisect_left(names, prefix + '\xff', start)
+    return names[start:end]
+
+
+class Help(object):
+    '''
+    Help of a command, parsed from its docstring::
+
+        syntax:  grep [<options>] <pattern>
+        example: grep test
+
+        options:
+            -c  Suppress normal output
+
+        description of the command
+
+    The ``text`` is the whole docstring, dedented and with ``\r\n`` line
+    endings, ready to send.
+    '''
+
+    def __init__(self, doc):
+        lines = textwrap.dedent(doc or '').strip().splitlines()
+        self.text = '\r\n'.join(lines)
+        self.syntax = ''
+        self.example = ''
+        self.options = []
+        description = []
+        options = False
+        for line in lines:
+            if line.startswith('syntax:'):
+                self.syntax = line[7:].strip()
+            elif line.startswith('example:'):
+                self.example = line[8:].strip()
+            elif line.strip() == 'options:':
+                options = True
+            elif options and line[:1] in (' ', '\t'):
+                flag, text = (line.strip().split(None, 1) + [''])[:2]
+                self.options.append((flag, text))
+            elif line.strip():
+                options = False
+                description.append(line)
+            elif not options:
+                description.append(line)
+        self.description = '\n'.join(description).strip()
+        # the syntax without the command name
+        self.arguments = ' '.join(self.syntax.split()[1:])
+
+
+def get_help(handler):
+    '''
+    Returns the :class:`Help` of a command, it is parsed from the docstring
+    once and kept with the function.
+    '''
+    func = getattr(handler, 'im_func', handler)
+    try:
+        return func.help
+    except AttributeError:
+        func.help = Help(func.__doc__)
+        return func.help
+
+
+class SectionType(type):
+    '''
+    Keeps a sorted index of the commands of each section class, so they
+    do not have to be looked up on every access. The index is rebuilt for
+    the class and its subclasses when an attribute of the class changes.
+
+    The ``generation`` is bumped whenever the commands of a class change,
+    so anything derived from them can be invalidated. Changes to a section
+    tree bump the ``tree_generation`` of its root instead, see
+    :meth:`Section.changed`.
+    '''
+
+    generation = 0
+
+    def __init__(cls, name, bases, attrs):
+        super(SectionType, cls).__init__(name, bases, attrs)
+        cls._subclasses = []
+        for base in bases:
+            if isinstance(base, SectionType):
+                base._subclasses.append(cls)
+        cls._index()
+
+    def __setattr__(cls, name, value):
+        super(SectionType, cls).__setattr__(name, value)
+        if not name.startswith('_'):
+            cls._index()
+
+    def __delattr__(cls, name):
+        super(SectionType, cls).__delattr__(name)
+        if not name.startswith('_'):
+            cls._index()
+
+    def _index(cls):
+        names = []
+        for attr in dir(cls):
+            if getattr(getattr(cls, attr, None), 'is_method', False):
+                names.append(attr)
+        cls._commands = tuple(sorted(names))
+        cls._command_set = frozenset(names)
+        SectionType.generation += 1
+        for subclass in cls._subclasses:
+            subclass._index()
+
+
 class Section(object):
+    __metaclass__ = SectionType
     name = None
+    tree_generation = 0
 
     def __init__(self, parent=None, aliases=None, interface=None):
         self.parent = parent
         self.aliases = aliases or {}
         self.children = {}
+        self.children_index = []
         self.interface = interface
 
     def __contains__(self, func):
-        try:
-            return self[func].is_method
-        except AttributeError:
-            return False
+        return func in self._command_set
 
     def __getitem__(self, func):
         return getattr(self, func)
 
     @property
     def commands(self):
-        for attr in dir(self):
-            try:
-                if getattr(self, attr).is_method:
-                    yield attr
-            except AttributeError:
-                pass
+        '''
+        Sorted names of the commands in this section.
+        '''
+        return self._commands
 
     @property
     def path(self):
@@ -76,14 +215,28 @@ class Section(object):
         return node
 
     def addchild(self, section):
+        if section.name not in self.children:
+            insort(self.children_index, section.name)
         self.children[section.name] = section
         self.children[section.name].parent = self
         self.children[section.name].interface = self.interface
+        self.changed()
 
     def delchild(self, section):
         if section.name in self.children:
             self.children[section.name].parent = None
             del self.children[section.name]
+            del self.children_index[bisect_left(self.children_index,
+                section.name)]
+            self.changed()
+
+    def changed(self):
+        '''
+        Bump the ``tree_generation`` of the root of the tree this section is
+        in, after the tree changed. Other trees keep what they derived from
+        their sections.
+        '''
+        self.root.tree_generation += 1
 
     def getchild(self, name):
         return self.children[name]
@@ -94,6 +247,44 @@ class Section(object):
         else:
             return section in self.children
 
+    def descend(self, part, limit=None):
+        '''
+        Follow the section names at the start of the token list ``part``
+        down the tree, at most ``limit`` levels deep. Returns the last
+        section found and the number of tokens used.
+        '''
+        if limit is None:
+            limit = len(part)
+        node = self
+        index = 0
+        while index < limit and part[index] in node.children:
+            node = node.children[part[index]]
+            index += 1
+        return node, index
+
+    def resolve(self, part):
+        '''
+        Resolve the token list ``part`` to the node and bound handler of
+        the command it contains, descending down the children that are
+        named before the command. Returns the node, the handler and the
+        arguments, or ``None, None, part`` if no node can handle it.
+        '''
+        if not part:
+            return None, None, part
+
+        # the last token can only be the command
+        node, index = self.descend(part, len(part) - 1)
+        name = part[index]
+        # the node we found in the tree can handle the command
+        if name in node:
+            return node, getattr(node, name), part[index + 1:]
+        # the root node can handle the command
+        root = self.root
+        if name in root:
+            return root, getattr(root, name), part[index + 1:]
+        # no node can handle the command
+        return None, None, part
+
     def lookup(self, line):
         '''
         Lookup a (child) node that will handle the line containing
@@ -101,55 +292,61 @@ class Section(object):
         command is found.
         '''
         part = line.split()
-        node = self
-        if len(part) > 1:
-            if self.haschild(part[0]):
-                name = part.pop(0)
-                return self.getchild(name).lookup(' '.join(part))
-
-        # the node we found in the tree can handle the command
-        if part[0] in node:
-            return node, part.pop(0), part
-        # the rood node can handle the command
-        elif part[0] in self.root:
-            return self.root, part[0], part
-        # no node can handle the command
-        else:
-            return None, None, part
+        node, handler, args = self.resolve(part)
+        if node:
+            return node, part[-len(args) - 1], args
+        return None, None, args
 
     def execute(self, sink, line):
         '''
         Execute a command or change to the given section, firstly
         we try to interpret the line as a command; if that fails we
         will descend down the children to see if the given line is
-        a section.
+        a section. The line is either a string or a list of tokens.
 
-        This function returns ``True`` if the line was executed.
+        This function returns ``True`` if the line was executed, or a
+        generator if the command is a coroutine (see :meth:`resume`).
         '''
-        node, func, args = self.lookup(line)
-        if node and func:
+        if isinstance(line, basestring):
+            part = line.split()
+        else:
+            part = line
+        node, handler, args = self.resolve(part)
+        if getattr(handler, 'raw', False):
+            args = [' '.join(args)]
+        return self.dispatch(sink, part, (node, handler, args))
+
+    def dispatch(self, sink, part, resolved, offload=None):
+        '''
+        Execute the token list ``part``, as resolved by :meth:`resolve`.
+        Commands that are not offloaded themselves are offloaded as given
+        by ``offload``.
+        '''
+        node, handler, args = resolved
+        if node:
+            offload = getattr(handler, 'offload', None) or offload
+            if offload == 'thread':
+                return self.offload(sink, Job(handler, sink, *args))
+            elif offload == 'process':
+                return self.offload(sink, Job(call_in_process, sink, handler,
+                    *args))
             try:
-                node[func](sink, *args)
+                done = handler(sink, *args)
             except StopIteration:
                 return False
+            except BrokenPipe:
+                # the filters have seen enough
+                return True
             except Exception, error:
-                sink.stderr = 'exception: %s (see `traceback`)\r\n' % (str(error),)
-                self.interface.errors.append((error, traceback.format_exc()))
+                self._exception(sink, error)
                 return False
             else:
+                if isinstance(done, GeneratorType):
+                    return self.resume(sink, done)
                 return True
         else:
-            part = line.split()
-            node = self
-            while part:
-                name = part.pop(0)
-                if node.haschild(name):
-                    node = node.getchild(name)
-                else:
-                    # no matching child section, bail out
-                    break
-
-            if len(part) == 0 and node != self:
+            node, index = self.descend(part)
+            if index == len(part) and node != self:
                 self.interface.section = node
                 #self.interface.sendline('')
                 return True
@@ -157,35 +354,116 @@ class Section(object):
         # still here?
         self.interface.sendline('error: command not found')
 
-    def complete(self, line, include_root=True):
-        part = RE_SPACING.split(line)
-        if len(part):
-            name = part.pop(0)
+    def resume(self, sink, coroutine):
+        '''
+        Step a command that is implemented as a generator, so it can give
+        other sessions a chance to run. This yields ``None`` while the
+        command is running, or the :class:`~cli.executor.Job` the command
+        yielded if it waits for one, and ``True`` or ``False`` when it is
+        done.
+        '''
+        try:
+            for step in coroutine:
+                if sink.cancelled:
+                    coroutine.close()
+                    break
+                if isinstance(step, Job):
+                    yield step
+                else:
+                    yield None
+        except BrokenPipe:
+            yield True
+        except Exception, error:
+            self._exception(sink, error)
+            yield False
         else:
-            name = ''
-
-        # if there is no remaining elements after the first word, assume
-        # the item we are locating is either a command or a section in
-        # this node
-        if len(part) == 0:
-            cmnds = [c for c in self.commands if c.startswith(name)]
-            sects = [s for s in self.children if s.startswith(name)]
-            # include root commands, but only if the current node is not the
-            # root node
-            if include_root and self != self.root:
-                cmnds.extend([c for c in self.root.commands if c.startswith(name)])
-            # de-duplication
-            return list(set(cmnds + sects))
-        # otherwise, try to complete the line in the node with a matching
-        # name; is all fails, we are not able to complete the request
+            yield True
+
+    def offload(self, sink, job):
+        '''
+        Run a command in the worker pool of the interface, so the session
+        keeps processing input. This yields the job while it is running,
+        and ``True`` or ``False`` when it is done. Output the command writes
+        is passed on as it is produced.
+        '''
+        stream = sink.stream
+        if stream is not None:
+            sink.redirect(job.write)
+        self.interface.executor.submit(job)
+        try:
+            while True:
+                # clear first, a job that is done after reading ``done``
+                # sets it again and wakes us up
+                job.changed.clear()
+                done = job.done
+                if stream is not None:
+                    job.drain(stream)
+                if done:
+                    break
+                yield job
+        finally:
+            if stream is not None:
+                sink.redirect(stream)
+
+        if isinstance(job.error, StopIteration):
+            yield False
+        elif job.error is None or isinstance(job.error, BrokenPipe):
+            yield True
         else:
-            if self.haschild(name):
-                # prepend the section name to the completed commands
-                return map(lambda item: ' '.join([name, item]),
-                    self.getchild(name).complete(' '.join(part),
-                        include_root=False))
-            else:
-                return []
+            self._exception(sink, job.error, job.traceback)
+            yield False
+
+    def _exception(self, sink, error, trace=None):
+        sink.stderr = 'exception: %s (see `traceback`)\r\n' % (str(error),)
+        self.interface.errors.append(error, trace)
+        if stats.enabled:
+            stats.count('errors')
+
+    def _get_help(self, *args):
+        '''
+        Returns the :class:`Help` of the command named by the arguments, or
+        ``None`` if there is no such command.
+        '''
+        part = []
+        for arg in args:
+            part.extend(arg.split())
+        node, handler, args = self.resolve(part)
+        if node:
+            return get_help(handler)
+        else:
+            return None
+
+    def complete(self, line, include_root=True):
+        '''
+        Returns the sorted completions for the line, that is all commands
+        and sections matching the last word of the line, prefixed with the
+        section path that precedes it.
+        '''
+        part = RE_SPACING.split(line)
+        name = part.pop()
+
+        # descend down the sections named before the word to complete, if
+        # all fails we are not able to complete the request
+        node, index = self.descend(part)
+        if index < len(part):
+            return []
+        elif index:
+            include_root = False
+
+        # the item we are locating is either a command or a section in this
+        # node, include root commands, but only if the current node is not
+        # the root node
+        items = set(startswith(node.commands, name))
+        items.update(startswith(node.children_index, name))
+        if include_root and node != node.root:
+            items.update(startswith(node.root.commands, name))
+        items = sorted(items)
+
+        if part:
+            # prepend the section path to the completed items
+            path = ' '.join(part + [''])
+            return [''.join([path, item]) for item in items]
+        return items
 
     def senddata(self, sink, data):
         return sink.write(data)
@@ -215,15 +493,14 @@ class Root(Section):
         shows help for the given command
         '''
         if args:
-            docs = self._get_doc(*args)
-            if docs is not None:
-                text = '\r\n'.join(textwrap.dedent(docs).strip().splitlines())
+            help = self.interface.section._get_help(*args)
+            if help is not None:
                 if kwargs.get('single', False):
-                    self.sendline(sink, text.splitlines()[0])
+                    self.sendline(sink, help.text.split('\r\n')[0])
                 else:
-                    self.sendline(sink, text)
+                    self.sendline(sink, help.text)
             else:
-                self.interface.sendline('error: command not found')
+                self.sendline(sink, 'error: command not found')
 
         else:
             self.help(sink, 'help')
@@ -231,21 +508,6 @@ class Root(Section):
             self.sendline(sink, 'limited tab completion is available')
             self.sendline(sink, 'limited command expansion is available with "?"')
 
-    def _get_doc(self, *args):
-        node, func, args = self.lookup(' '.join(args))
-        if node and func:
-            return node[func].__doc__ or ''
-        else:
-            return None
-
-    def _get_syntax(self, *args):
-        docs = self._get_doc(*args)
-        if docs:
-            for line in docs.strip().splitlines():
-                if line.startswith('syntax:'):
-                    return ' '.join(line.split()[2:])
-        return ''
-
     @command
     def history(self, sink, *args):
         '''
@@ -258,6 +520,136 @@ class Root(Section):
             if i > 0:
                 self.senddata(sink, '%d.\t%s\r\n' % (i, command))
 
+    @command
+    def cache(self, sink, *args):
+        '''
+        syntax:  cache [clear]
+        example: cache
+
+        shows the command line cache statistics, or clears the cache
+        '''
+        cache = self.interface.cache
+        if args and args[0] == 'clear':
+            cache.clear()
+        lookups = cache.hits + cache.misses
+        self.sendline(sink, 'entries: %d/%d' % (len(cache), cache.size))
+        self.sendline(sink, 'hits:    %d' % (cache.hits,))
+        self.sendline(sink, 'misses:  %d' % (cache.misses,))
+        if lookups:
+            self.sendline(sink, 'ratio:   %.1f%%' % (
+                100.0 * cache.hits / lookups,))
+
+    @command
+    def stats(self, sink, *args):
+        '''
+        syntax:  stats [on|off|reset]
+        example: stats
+
+        shows the time taken by commands and filters, and the bytes in and
+        out of this session; statistics are only recorded while enabled
+        '''
+        if args and args[0] in ('on', 'off'):
+            stats.enabled = args[0] == 'on'
+        elif args and args[0] == 'reset':
+            stats.reset()
+
+        self.sendline(sink, 'statistics: %s' % (stats.enabled and 'on' or
+            'off',))
+        self.sendline(sink, 'session:    %d bytes in, %d bytes out' % (
+            self.interface.bytes_in, self.interface.bytes_out))
+
+        snapshot = stats.snapshot()
+        if snapshot['histograms']:
+            self.sendline(sink, '')
+            self.sendline(sink, '%-30s %8s %10s %9s %9s %9s' % ('command',
+                'count', 'total ms', 'mean ms', 'p99 ms', 'max ms'))
+            for name, summary in sorted(snapshot['histograms'].iteritems()):
+                self.sendline(sink, '%-30s %8d %10.1f %9.3f %9.3f %9.3f' % (
+                    name, summary['count'], summary['total'] * 1e3,
+                    summary['mean'] * 1e3, summary['p99'] * 1e3,
+                    summary['max'] * 1e3))
+        if snapshot['counters']:
+            self.sendline(sink, '')
+            for name, value in sorted(snapshot['counters'].iteritems()):
+                self.sendline(sink, '%-30s %8d' % (name, value))
+
+    @command(raw=True)
+    def profile(self, sink, line=''):
+        '''
+        syntax:  profile [-n <count>] [-s <order>] [-o <file>] <command>
+        example: profile -n 10 show interfaces | inc up
+
+        runs the command, with its filters, under the profiler and shows the
+        functions that took most time; -s orders them by cumulative (the
+        default), time or calls, -o also saves the profile to a file in the
+        profile directory of the interface
+        '''
+        tokens = list(parse(line))
+        try:
+            opts, argv = getopt.getopt([str(token) for token in tokens],
+                'n:o:s:')
+            opts = dict(opts)
+            count = int(opts.get('-n', 20))
+        except getopt.GetoptError, error:
+            sink.error(''.join(['profile: ', str(error), '\r\n']))
+            return
+        except ValueError:
+            sink.error('profile: invalid numeric value\r\n')
+            return
+
+        order = opts.get('-s', 'cumulative')
+        if order not in ('cumulative', 'time', 'calls'):
+            sink.error('profile: invalid order %s\r\n' % (order,))
+            return
+        directory = self.interface.profile_directory
+        if '-o' in opts and directory is None:
+            sink.error('profile: no profile directory\r\n')
+            return
+        if not argv:
+            sink.error('profile: no command\r\n')
+            return
+
+        # run the pipe into a sink of its own, so the report follows the
+        # output of the command
+        inner = Sink()
+        steps = self.interface.compile(line[tokens[-len(argv)].position:])
+        task = self.interface.pipeline(inner, steps)
+        profiler = cProfile.Profile()
+        try:
+            while True:
+                # only profile this command, not the sessions that run
+                # while it waits
+                profiler.enable()
+                try:
+                    step = task.next()
+                except StopIteration:
+                    break
+                finally:
+                    profiler.disable()
+                yield step
+
+            profiler.enable()
+            try:
+                inner.close()
+            finally:
+                profiler.disable()
+        finally:
+            if sink.cancelled:
+                inner.cancel()
+                task.close()
+
+        self.senddata(sink, inner.output)
+        report = StringIO()
+        pstats.Stats(profiler, stream=report).strip_dirs().sort_stats(
+            order).print_stats(count)
+        for line in report.getvalue().strip('\n').splitlines():
+            self.sendline(sink, line)
+
+        if '-o' in opts:
+            filename = os.path.join(directory, os.path.basename(opts['-o']))
+            profiler.dump_stats(filename)
+            self.sendline(sink, 'profile saved to %s' % (filename,))
+
     @command
     def exit(self, sink, *args):
         '''
@@ -274,16 +666,29 @@ class Root(Section):
     @command
     def traceback(self, sink, *args):
         '''
-        syntax:  traceback
-        example: traceback
+        syntax:  traceback [<number>]
+        example: traceback 2
 
-        shows the traceback for the last exception, if available
+        shows the traceback for the last exception, or for an older one,
+        counting back from the last exception, if available
         '''
-        if self.interface.errors:
-            for line in self.interface.errors[-1][1].splitlines():
-                self.sendline(sink, line)
+        errors = self.interface.errors
+        if not args:
+            number = 1
         else:
+            try:
+                number = int(args[0])
+            except ValueError:
+                number = 0
+
+        trace = errors.traceback(number)
+        if trace is None:
             self.sendline(sink, 'no traceback available')
+            return
+
+        self.sendline(sink, 'exception %d of %d:' % (number, len(errors)))
+        for line in trace.splitlines():
+            self.sendline(sink, line)
 
     @command
     def version(self, sink):
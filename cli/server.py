@@ -0,0 +1,507 @@
+#! /usr/bin/env python
+#
+#                         _______
+#   ____________ _______ _\__   /_________       ___  _____
+#  |    _   _   \   _   |   ____\   _    /      |   |/  _  \
+#  |    /   /   /   /   |  |     |  /___/   _   |   |   /  /
+#  |___/___/   /___/____|________|___   |  |_|  |___|_____/
+#          \__/                     |___|
+#
+#
+# (c) 2010 Wijnand 'maze' Modderman-Lenstra - http://maze.io/
+#
+
+__author__    = 'Wijnand Modderman-Lenstra <maze@pyth0n.org>'
+__copyright__ = '(C) 2010 Wijnand Modderman-Lenstra'
+__license__   = 'MIT'
+__url__       = 'http://code.maze.io/'
+
+from cli import Interface
+from cli.executor import Executor
+from cli.history import HistoryFile, SharedHistory
+from collections import deque
+import errno
+import fcntl
+import os
+import select
+import socket
+import sys
+import time
+
+EVENT_READ  = 0x001
+EVENT_WRITE = 0x004
+EVENT_ERROR = 0x008 | 0x010
+
+
+class SelectPoller(object):
+    '''
+    Poller using plain ``select.select``, used on platforms that lack
+    anything better.
+    '''
+
+    def __init__(self):
+        self.fds = {}
+
+    def register(self, fd, events):
+        self.fds[fd] = events
+
+    def modify(self, fd, events):
+        self.fds[fd] = events
+
+    def unregister(self, fd):
+        self.fds.pop(fd, None)
+
+    def poll(self, timeout=None):
+        r = [fd for fd, events in self.fds.iteritems() if events & EVENT_READ]
+        w = [fd for fd, events in self.fds.iteritems() if events & EVENT_WRITE]
+        try:
+            r, w, e = select.select(r, w, [], timeout)
+        except select.error, error:
+            if error.args[0] == errno.EINTR:
+                return []
+            raise
+
+        ready = {}
+        for fd in r:
+            ready[fd] = ready.get(fd, 0) | EVENT_READ
+        for fd in w:
+            ready[fd] = ready.get(fd, 0) | EVENT_WRITE
+        return ready.items()
+
+
+class PollPoller(object):
+    '''
+    Poller using ``select.poll``, timeouts are in seconds.
+    '''
+
+    def __init__(self):
+        self.poller = select.poll()
+
+    def register(self, fd, events):
+        self.poller.register(fd, events)
+
+    def modify(self, fd, events):
+        self.poller.modify(fd, events)
+
+    def unregister(self, fd):
+        self.poller.unregister(fd)
+
+    def poll(self, timeout=None):
+        if timeout is not None:
+            timeout = int(timeout * 1000)
+        try:
+            return self.poller.poll(timeout)
+        except select.error, error:
+            if error.args[0] == errno.EINTR:
+                return []
+            raise
+
+
+class EpollPoller(PollPoller):
+    '''
+    Poller using ``select.epoll``, this scales with the number of active
+    sessions rather than the number of connected sessions.
+    '''
+
+    def __init__(self):
+        self.poller = select.epoll()
+
+    def poll(self, timeout=None):
+        if timeout is None:
+            timeout = -1
+        try:
+            return self.poller.poll(timeout)
+        except IOError, error:
+            if error.args[0] == errno.EINTR:
+                return []
+            raise
+
+
+if hasattr(select, 'epoll'):
+    Poller = EpollPoller
+elif hasattr(select, 'poll'):
+    Poller = PollPoller
+else:
+    Poller = SelectPoller
+
+
+class Session(Interface):
+    '''
+    Interface bound to a non-blocking client connection of a
+    :class:`Server`.
+
+    Output is buffered and written when the socket is writable; once more
+    than ``high_water`` bytes are pending the session stops reading input
+    and stops stepping its running command until the buffer drained.
+
+    Commands that are not coroutines run to completion in the event loop
+    and can not be held back, all of their output is queued. Commands with
+    a large output should be coroutines, or be offloaded; setting
+    ``offload = 'thread'`` runs every plain command in the worker pool.
+    '''
+
+    high_water = 64 * 1024
+
+    def __init__(self, server, socket, address, **kwargs):
+        self.server = server
+        self.address = address
+        self.fd = socket.fileno()
+        self.registered = EVENT_READ
+        self.closing = False
+        self.pending = deque()
+        self.task = None
+        socket.setblocking(0)
+        Interface.__init__(self, socket, **kwargs)
+
+    @property
+    def blocked(self):
+        return self.outgoing_size >= self.high_water
+
+    @property
+    def events(self):
+        events = 0
+        if self.outgoing:
+            events |= EVENT_WRITE
+        if not self.closing and not self.blocked:
+            events |= EVENT_READ
+        return events
+
+    def read(self):
+        try:
+            data = self.socket.recv(self.recv_size)
+        except socket.error, error:
+            if error.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        self.feed(data)
+
+    def feed(self, data):
+        if self.closing:
+            return
+        elif not data:
+            Interface.feed(self, data)
+            return
+
+        self.pending.extend(self.decoder.feed(data))
+        if self.decoder.pending:
+            self.server.partial.add(self)
+        self.handle_pending()
+
+    def expire(self):
+        self.pending.extend(self.decoder.expire())
+        self.handle_pending()
+
+    def handle_pending(self):
+        # type-ahead is queued while a command is running, except for ^C
+        # which cancels the command
+        while self.pending and not self.closing:
+            if self.task is None:
+                self.handle_key(self.pending.popleft())
+            elif self.pending[0] == '\x03':
+                self.pending.popleft()
+                self.cancel()
+            else:
+                break
+
+    def write(self, data):
+        # the server flushes all output after processing a round of events
+        Interface.write(self, data)
+        self.server.dirty.add(self)
+
+    def run(self, task):
+        self.task = task
+        self.step()
+
+    def step(self):
+        try:
+            step = self.task.next()
+        except StopIteration:
+            self.task = None
+            self.server.runnable.discard(self)
+            self.handle_pending()
+        else:
+            if step is None:
+                self.server.runnable.add(self)
+            else:
+                # the command runs in the worker pool, we are woken up when
+                # it has output or is done
+                self.server.runnable.discard(self)
+                step.notify(self.server.wake, self)
+
+    def close(self):
+        self.is_running = False
+        self.closing = True
+        self.cancel()
+        try:
+            self.flush()
+        except socket.error:
+            self.server.detach(self)
+        else:
+            self.server.update(self)
+
+
+class Server(object):
+    '''
+    Accept TCP connections and drive all their sessions from a single
+    event loop. Idle sessions are not woken up until their client sends
+    data. All sessions share a single history, kept in ``history_file`` if
+    it is set, and a pool of ``workers`` threads for offloaded commands,
+    see :class:`cli.executor.Executor`.
+
+        >>> from cli.server import Server
+        >>> server = Server(('0.0.0.0', 12345))
+        >>> server.loop()
+    '''
+
+    session_class = Session
+    history_file = None
+    workers = 4
+
+    def __init__(self, address=('0.0.0.0', 12345), backlog=128, **kwargs):
+        self.address = address
+        self.kwargs = kwargs
+        if self.history_file:
+            self.history = SharedHistory(HistoryFile(
+                os.path.expanduser(self.history_file)))
+        else:
+            self.history = SharedHistory()
+        self.executor = Executor(self.workers)
+        self.sessions = {}
+        self.dirty = set()
+        self.partial = set()
+        self.runnable = set()
+        self.is_running = True
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(address)
+        self.socket.listen(backlog)
+        self.socket.setblocking(0)
+        self.poller = Poller()
+        self.poller.register(self.fileno(), EVENT_READ)
+
+        # worker threads wake up the event loop through a pipe
+        self.woken = deque()
+        self.waker, self.waker_write = os.pipe()
+        for fd in (self.waker, self.waker_write):
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.poller.register(self.waker, EVENT_READ)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def getsockname(self):
+        return self.socket.getsockname()
+
+    def setup(self, session):
+        '''
+        Called for every new session, override this to populate the
+        section tree of the session.
+        '''
+        pass
+
+    def accept(self):
+        while True:
+            try:
+                conn, address = self.socket.accept()
+            except socket.error, error:
+                if error.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = self.session_class(self, conn, address,
+                history=self.history.cursor(), **self.kwargs)
+            session.executor = self.executor
+            self.sessions[session.fd] = session
+            self.poller.register(session.fd, session.registered)
+            self.setup(session)
+
+    def wake(self, session):
+        '''
+        Make a session runnable again, may be called from any thread.
+        '''
+        self.woken.append(session)
+        try:
+            os.write(self.waker_write, 'x')
+        except OSError, error:
+            if error.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def awake(self):
+        try:
+            while os.read(self.waker, 4096):
+                pass
+        except OSError, error:
+            if error.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+        while self.woken:
+            session = self.woken.popleft()
+            if session.fd in self.sessions and session.task is not None:
+                self.runnable.add(session)
+
+    def detach(self, session):
+        session.cancel()
+        fd = session.fd
+        self.dirty.discard(session)
+        self.partial.discard(session)
+        self.runnable.discard(session)
+        if self.sessions.pop(fd, None) is not None:
+            self.poller.unregister(fd)
+            session.socket.close()
+            session.history.close()
+
+    def update(self, session):
+        '''
+        Update the events we are interested in for the given session.
+        '''
+        if session.fd not in self.sessions:
+            return
+        if not session.output and not session.outgoing:
+            self.dirty.discard(session)
+            if session.closing:
+                self.detach(session)
+                return
+
+        events = session.events
+        if events != session.registered:
+            self.poller.modify(session.fd, events)
+            session.registered = events
+
+    def process(self, fd, events):
+        session = self.sessions.get(fd)
+        if session is None:
+            return
+
+        try:
+            if events & EVENT_READ:
+                session.read()
+            if events & EVENT_WRITE:
+                session.flush()
+            if events & EVENT_ERROR and not events & EVENT_READ:
+                self.detach(session)
+                return
+            if not session.is_running:
+                session.close()
+        except socket.error:
+            self.detach(session)
+            return
+        except Exception:
+            self.fail(session)
+            return
+
+        self.update(session)
+
+    def fail(self, session):
+        '''
+        Drop a session after an unexpected error while processing it; the
+        error is kept in the errors of the session, the other sessions
+        carry on.
+        '''
+        session.errors.append(sys.exc_info()[1])
+        self.detach(session)
+
+    def flush(self):
+        for session in list(self.dirty):
+            try:
+                session.flush()
+            except socket.error:
+                self.detach(session)
+            except Exception:
+                self.fail(session)
+            else:
+                self.update(session)
+
+    def loop(self, timeout=None):
+        '''
+        Run the event loop until :meth:`stop` is called.
+        '''
+        while self.is_running:
+            self.poll(timeout)
+
+    def poll(self, timeout=None):
+        '''
+        Wait for and process a single round of events, then give every
+        running command a chance to make progress.
+        '''
+        runnable = [session for session in self.runnable
+            if not session.blocked]
+        if runnable:
+            timeout = 0
+        elif self.partial:
+            # wake up in time to resolve partial escape sequences
+            deadline = min(session.decoder.deadline or 0
+                for session in self.partial)
+            wait = max(0, deadline - time.time())
+            if timeout is None or wait < timeout:
+                timeout = wait
+
+        listener = self.fileno()
+        for fd, events in self.poller.poll(timeout):
+            if fd == listener:
+                self.accept()
+            elif fd == self.waker:
+                self.awake()
+            else:
+                self.process(fd, events)
+
+        if self.partial:
+            now = time.time()
+            for session in list(self.partial):
+                if session.decoder.pending and session.decoder.deadline > now:
+                    continue
+                self.partial.discard(session)
+                try:
+                    session.expire()
+                    if not session.is_running:
+                        session.close()
+                except socket.error:
+                    self.detach(session)
+                except Exception:
+                    self.fail(session)
+
+        for session in runnable:
+            if session.task is not None and not session.blocked:
+                try:
+                    session.step()
+                    if not session.is_running:
+                        session.close()
+                except socket.error:
+                    self.detach(session)
+                except Exception:
+                    self.fail(session)
+
+        self.flush()
+
+    def stop(self):
+        self.is_running = False
+
+    def close(self):
+        self.stop()
+        for session in self.sessions.values():
+            self.detach(session)
+        self.poller.unregister(self.fileno())
+        self.poller.unregister(self.waker)
+        self.socket.close()
+        os.close(self.waker)
+        os.close(self.waker_write)
+        self.history.close()
+        # the commands of the sessions are cancelled, see detach
+        self.executor.shutdown()
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 1:
+        port = int(sys.argv[1])
+    else:
+        port = 12345
+
+    server = Server(('0.0.0.0', port))
+    try:
+        server.loop()
+    finally:
+        server.close()
@@ -16,24 +16,58 @@ __copyright__ = '(C) 2010 Wijnand Modderman-Lenstra'
 __license__   = 'MIT'
 __url__       = 'http://code.maze.io/'
 
-try:
-    from cStringIO import StringIO
-except ImportError:
-    from StringIO import StringIO
-try:
-    reduce(lambda a: a, [None])
-except NameError:
-    from functools import reduce
-from operator import add
-import time
+from cli.stats import Timed, stats
+import re
+
+RE_LINE = re.compile(r'(?:\r\n|\n)')
+
+
+class BrokenPipe(Exception):
+    '''
+    Raised when writing to a sink whose filters do not want any more
+    output, for example after ``head`` has seen enough lines.
+    '''
+    pass
+
+
+class Cancelled(BrokenPipe):
+    '''
+    Raised when writing to a sink whose command was cancelled, for example
+    because the user pressed ^C.
+    '''
+    pass
+
+
+def output(target):
+    '''
+    Last stage of a filter pipeline, writes lines to the given file-like.
+    '''
+    while True:
+        line = (yield)
+        target.write(''.join([line, '\r\n']))
 
 
 class FileLike(list):
     '''
     Allow file-like calls on this buffer.
+
+    The buffer is a list of the written chunks. Buffers sharing a ``journal``
+    record in it where each run of writes to one buffer starts, as a
+    ``(buffer, offset, epoch)`` tuple, so their output can be interleaved
+    again in the order it was written. Flushing a buffer starts a new
+    ``epoch``, the runs of earlier epochs are skipped from then on.
+
+    If a ``stream`` callable is given, written data is passed on to it as
+    it is produced instead of being collected.
     '''
 
-    def __init__(self, data=None):
+    def __init__(self, data=None, stream=None, journal=None):
+        self.stream = stream
+        if journal is None:
+            journal = []
+        self.journal = journal
+        self.epoch = 0
+        self.size = 0
         if data:
             self.write(data)
 
@@ -53,37 +87,88 @@ class FileLike(list):
         return self.getvalue()
 
     def tell(self):
-        return len(self.getvalue())
+        return self.size
 
     def flush(self):
-        for x in xrange(0, len(self)):
-            self.pop(0)
+        del self[:]
+        self.epoch += 1
+        self.size = 0
 
     def write(self, data):
-        self.append((time.time(), data))
+        if self.stream is None:
+            journal = self.journal
+            if not journal or journal[-1][0] is not self or \
+                journal[-1][2] != self.epoch:
+                journal.append((self, len(self), self.epoch))
+            self.append(data)
+            self.size += len(data)
+        else:
+            self.stream(data)
         return self
 
     def getvalue(self):
-        return ''.join((chunk[1] for chunk in self))
+        return ''.join(self)
 
 
 class Sink(object):
     '''
     Output sink that collects data.
+
+    A streaming sink passes all data written to its ``stream`` callable
+    straight away, so the output of stdout and stderr reaches the client in
+    the order it was written, while nothing is held in memory.
     '''
 
-    def __init__(self, out=None, err=None):
+    def __init__(self, out=None, err=None, stream=None):
+        self.stream = stream
+        self.journal = []
         self.buffers = dict(
-            stdout = FileLike(),
-            stderr = FileLike(),
+            stdout = FileLike(stream=stream, journal=self.journal),
+            stderr = FileLike(stream=stream, journal=self.journal),
         )
+        self.input = None
+        self.stages = []
+        self.chain = None
+        self.blocks = False
+        self.timed = False
+        self.blocking = False
+        self.closed = False
+        self.failed = False
+        self.partial = ''
+        self.broken = False
+        self.cancelled = False
 
     def __iter__(self):
-        for chunk in sorted(reduce(add, self.buffers.values())):
-            yield chunk[1]
+        '''
+        Iterate over the chunks of all buffers in the order of writing.
+        '''
+        for buffer, start, end in self.runs():
+            for data in buffer[start:end]:
+                yield data
+
+    def runs(self):
+        '''
+        Iterate over the runs of writes to the same buffer, as
+        ``(buffer, start, end)`` tuples, in the order of writing.
+        '''
+        # a run ends where the next run of the same buffer starts; runs
+        # written before the buffer was flushed are skipped
+        runs = []
+        starts = {}
+        for buffer, start, epoch in reversed(self.journal):
+            if epoch == buffer.epoch:
+                runs.append((buffer, start,
+                    starts.get(id(buffer), len(buffer))))
+                starts[id(buffer)] = start
+
+        for run in reversed(runs):
+            yield run
 
     def stdout_get(self):
-        return self.buffers['stdout']
+        if self.input is None:
+            return self.buffers['stdout']
+        else:
+            return self.input
 
     def stdout_set(self, data):
         self.stdout.flush()
@@ -101,16 +186,153 @@ class Sink(object):
 
     @property
     def output(self):
-        return ''.join(list(iter(self)))
+        return ''.join([''.join(buffer[start:end])
+            for buffer, start, end in self.runs()])
 
     def flush(self):
         for item in self.buffers:
             self.buffers[item].flush()
+        # all runs are stale now
+        del self.journal[:]
 
     reset = flush
 
     def write(self, data):
-        self.buffers['stdout'].write(data)
+        if self.cancelled:
+            raise Cancelled()
+        self.stdout.write(data)
+
+    def cancel(self):
+        '''
+        Cancel the command writing to this sink. Commands stop at their next
+        write, long running commands should check ``cancelled`` as well.
+        '''
+        self.cancelled = True
+
+    def redirect(self, stream):
+        '''
+        Stream the output of this sink to another callable.
+        '''
+        self.stream = stream
+        for buffer in self.buffers.values():
+            buffer.stream = stream
+
+    def pipe(self, stage, *args, **kwargs):
+        '''
+        Send stdout through a filter stage. A stage is a generator function
+        that is called with the next stage and ``args``; it receives lines
+        (without line endings) and sends the lines it passes on to the next
+        stage. A stage may raise :class:`BrokenPipe` to stop the command.
+
+        Stages see the output line by line as it is written, no more than a
+        single line is held in memory. A first stage with a true ``blocks``
+        attribute is sent the complete lines of each write at once instead,
+        joined by newlines, so it can match them in one go.
+
+        The ``name`` keyword names the stage in the statistics, normally
+        after the filter command; it defaults to the name of the function.
+
+        A stage with a true ``blocking`` attribute waits for other
+        processes; commands piped through it are run in a worker, see
+        :meth:`cli.Interface.pipeline`.
+        '''
+        self.stages.append((stage, args, kwargs.get('name',
+            stage.__name__)))
+        if getattr(stage, 'blocking', False):
+            self.blocking = True
+        self.input = FileLike(stream=self.feed)
+
+    def build(self):
+        # time the stages if statistics are enabled, see Stats.stages
+        self.timed = stats.enabled
+        target = output(self.buffers['stdout'])
+        if self.timed:
+            target = Timed(target, 'output')
+        target.next()
+        self.chain = [target]
+        self.blocks = getattr(self.stages[0][0], 'blocks', False)
+        for stage, args, name in reversed(self.stages):
+            target = stage(target, *args)
+            if self.timed:
+                target = Timed(target, '| ' + name)
+            try:
+                target.next()
+            except BrokenPipe:
+                # this stage does not want any input at all
+                self.broken = True
+            self.chain.insert(0, target)
+
+    def feed(self, data):
+        '''
+        Split data written to stdout into lines and feed them to the first
+        filter stage.
+        '''
+        if self.chain is None:
+            self.build()
+        if self.broken:
+            raise BrokenPipe()
+
+        data = ''.join([self.partial, data])
+        if self.blocks:
+            end = data.rfind('\n')
+            self.partial = data[end + 1:]
+            if end == -1:
+                return
+            block = data[:end]
+            if '\r' in block:
+                block = data[:end + 1].replace('\r\n', '\n')[:-1]
+            lines = [block]
+        else:
+            lines = RE_LINE.split(data)
+            self.partial = lines.pop()
+        send = self.chain[0].send
+        try:
+            for line in lines:
+                send(line)
+        except (BrokenPipe, StopIteration):
+            self.broken = True
+            raise BrokenPipe()
+
+    def close(self):
+        '''
+        Pass on the last incomplete line and close all filter stages, so they
+        can send what they have been holding on to.
+
+        If the command ``failed`` the stages are closed last to first
+        instead, what they were holding on to is discarded; ``count`` does
+        not report a count for a command that did not run.
+        '''
+        if self.input is None or self.closed:
+            return
+        self.closed = True
+        if self.chain is None:
+            self.build()
+
+        if self.failed:
+            # a stage sending to a closed stage stops with StopIteration,
+            # which ends its close as well
+            for stage in reversed(self.chain):
+                stage.close()
+            self.partial = ''
+            self.broken = True
+            return
+
+        if self.partial and not self.broken:
+            try:
+                self.chain[0].send(self.partial)
+            except (BrokenPipe, StopIteration):
+                pass
+        self.partial = ''
+        self.broken = True
+
+        for stage in self.chain:
+            try:
+                stage.close()
+            except BrokenPipe:
+                pass
+
+        if self.timed:
+            stats.stages(self.chain)
 
     def error(self, data):
         self.buffers['stderr'].write(data)
@@ -0,0 +1,171 @@
+#! /usr/bin/env python
+#
+#                         _______
+#   ____________ _______ _\__   /_________       ___  _____
+#  |    _   _   \   _   |   ____\   _    /      |   |/  _  \
+#  |    /   /   /   /   |  |     |  /___/   _   |   |   /  /
+#  |___/___/   /___/____|________|___   |  |_|  |___|_____/
+#          \__/                     |___|
+#
+#
+# (c) 2010 Wijnand 'maze' Modderman-Lenstra - http://maze.io/
+#
+
+__author__    = 'Wijnand Modderman-Lenstra <maze@pyth0n.org>'
+__copyright__ = '(C) 2010 Wijnand Modderman-Lenstra'
+__license__   = 'MIT'
+__url__       = 'http://code.maze.io/'
+
+from math import frexp
+try:
+    from time import monotonic as clock
+except ImportError:
+    # Python 2 has no monotonic clock
+    from time import time as clock
+
+# histogram buckets are powers of two microseconds, up to about 1.5 days
+BUCKETS = 38
+
+
+class Histogram(object):
+    '''
+    Distribution of durations in seconds, counted in buckets that are
+    powers of two microseconds wide, so recording a value takes constant
+    time and space.
+    '''
+
+    def __init__(self):
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        bucket = frexp(value * 1e6)[1]
+        if bucket < 0:
+            bucket = 0
+        elif bucket >= BUCKETS:
+            bucket = BUCKETS - 1
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        '''
+        Returns the upper bound of the bucket holding the given percentile,
+        or the maximum if that is lower.
+        '''
+        rank = self.count * percent / 100.0
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank and bucket < BUCKETS - 1:
+                return min(2 ** bucket / 1e6, self.max)
+        # the last bucket has no upper bound
+        return self.max
+
+    @property
+    def mean(self):
+        return self.count and self.total / self.count or 0.0
+
+    def summary(self):
+        return dict(
+            count = self.count,
+            total = self.total,
+            mean = self.mean,
+            p50 = self.percentile(50),
+            p99 = self.percentile(99),
+            max = self.max,
+        )
+
+
+class Timed(object):
+    '''
+    Proxy for a filter stage that measures the time spent in it, including
+    the time spent in the stages it sends to.
+    '''
+
+    def __init__(self, stage, name):
+        self.stage = stage
+        self.name = name
+        self.elapsed = 0.0
+
+    def next(self):
+        start = clock()
+        try:
+            return self.stage.next()
+        finally:
+            self.elapsed += clock() - start
+
+    def send(self, value):
+        start = clock()
+        try:
+            return self.stage.send(value)
+        finally:
+            self.elapsed += clock() - start
+
+    def close(self):
+        start = clock()
+        try:
+            return self.stage.close()
+        finally:
+            self.elapsed += clock() - start
+
+
+class Stats(object):
+    '''
+    Counters and histograms of durations, by name. Nothing is recorded
+    unless ``enabled`` is set; instrumented code checks it before taking
+    any measurement, so disabled statistics cost an attribute lookup.
+    '''
+
+    enabled = False
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def record(self, name, value):
+        try:
+            self.histograms[name].add(value)
+        except KeyError:
+            histogram = self.histograms[name] = Histogram()
+            histogram.add(value)
+
+    def stages(self, chain):
+        '''
+        Record the time spent in each of the :class:`Timed` stages of a
+        filter chain, not counting the time spent in later stages. Stages
+        with the same name, set up by one filter, are recorded together.
+        '''
+        totals = {}
+        for stage, after in zip(chain, chain[1:] + [None]):
+            elapsed = stage.elapsed
+            if after is not None:
+                elapsed -= after.elapsed
+            totals[stage.name] = totals.get(stage.name, 0.0) + \
+                max(0.0, elapsed)
+        for name, elapsed in totals.iteritems():
+            self.record(name, elapsed)
+
+    def snapshot(self):
+        '''
+        Returns a copy of all statistics, for monitoring systems to scrape.
+        '''
+        return dict(
+            counters = dict(self.counters),
+            histograms = dict((name, histogram.summary())
+                for name, histogram in self.histograms.iteritems()),
+        )
+
+    def reset(self):
+        self.counters.clear()
+        self.histograms.clear()
+
+
+stats = Stats()
@@ -0,0 +1,58 @@
+'''
+Measure the time taken to complete a command in sections with an increasing
+number of commands and child sections, scanning all attributes and children
+versus the per-class command index and the sorted child index.
+'''
+
+from cli.section import Section, SectionType, command
+import time
+
+COMPLETIONS = 1000
+
+
+def scan(section):
+    for attr in dir(section):
+        try:
+            if getattr(section, attr).is_method:
+                yield attr
+        except AttributeError:
+            pass
+
+
+def build(size):
+    attrs = dict(name='big')
+    for x in xrange(size):
+        attrs['command%05d' % (x,)] = command(lambda self, sink: None)
+    section = SectionType('Big', (Section,), attrs)()
+    for x in xrange(size):
+        child = Section()
+        child.name = 'section%05d' % (x,)
+        section.addchild(child)
+    return section
+
+
+def measure(section):
+    t = time.time()
+    for x in xrange(COMPLETIONS):
+        [c for c in scan(section) if c.startswith('command0001')]
+        [s for s in section.children if s.startswith('section0001')]
+    scanned = time.time() - t
+
+    t = time.time()
+    for x in xrange(COMPLETIONS):
+        section.complete('command0001')
+        section.complete('section0001')
+    indexed = time.time() - t
+    return scanned, indexed
+
+
+def main():
+    print '%10s %14s %14s' % ('entries', 'scan (us)', 'index (us)')
+    for size in (10, 100, 1000):
+        scanned, indexed = measure(build(size))
+        print '%10d %14.1f %14.1f' % (size * 2, scanned * 1e6 / COMPLETIONS,
+            indexed * 1e6 / COMPLETIONS)
+
+
+if __name__ == '__main__':
+    main()
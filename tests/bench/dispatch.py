@@ -0,0 +1,74 @@
+'''
+Measure the number of commands per second dispatched through a 6-level
+section tree, with the original lookup that rebuilds the line at each level
+versus resolving the token list once.
+'''
+
+from cli.section import Section, command
+from cli.sink import Sink
+import time
+
+DEPTH = 6
+COMMANDS = 20000
+
+
+class Level(Section):
+    @command
+    def show(self, sink, *args):
+        pass
+
+
+class OldLevel(Level):
+    def lookup(self, line):
+        part = line.split()
+        node = self
+        if len(part) > 1:
+            if self.haschild(part[0]):
+                name = part.pop(0)
+                return self.getchild(name).lookup(' '.join(part))
+
+        if part[0] in node:
+            return node, part.pop(0), part
+        elif part[0] in self.root:
+            return self.root, part[0], part
+        else:
+            return None, None, part
+
+    def execute(self, sink, line):
+        node, func, args = self.lookup(line)
+        if node and func:
+            node[func](sink, *args)
+            return True
+
+
+def build(cls):
+    root = node = cls()
+    path = []
+    for depth in xrange(DEPTH):
+        for x in xrange(10):
+            child = cls()
+            child.name = 'level%d-%d' % (depth, x)
+            node.addchild(child)
+        node = child
+        path.append(child.name)
+    return root, path
+
+
+def measure(cls):
+    root, path = build(cls)
+    line = ' '.join(path + ['show', 'detail', 'all'])
+    sink = Sink()
+    t = time.time()
+    for x in xrange(COMMANDS):
+        root.execute(sink, line)
+    return COMMANDS / (time.time() - t)
+
+
+def main():
+    print '%10s %16s' % ('lookup', 'commands/s')
+    for name, cls in (('old', OldLevel), ('new', Level)):
+        print '%10s %16.0f' % (name, measure(cls))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+'''
+Measure the filters over a large table: the bytes left to send to the client
+and the lines per second, and the memory taken by the lines held for sort,
+kept as separate strings versus in the line store.
+'''
+
+from cli.filter import Filter, Lines
+from cli.sink import Sink
+import sys
+import time
+
+LINES = 200000
+CHUNK = 64
+
+
+def table():
+    lines = ['ethernet%d/%d %s %d %d' % (x % 4, x % 48,
+        ('up', 'down')[x % 3 == 0], x % 1500, x) for x in xrange(LINES)]
+    return lines, ['\n'.join(lines[x:x + CHUNK]) + '\n'
+        for x in xrange(0, len(lines), CHUNK)]
+
+
+def measure(command, chunks):
+    filter = Filter(None)
+    sink = Sink()
+    for part in command.split(' | '):
+        filter.execute(sink, part)
+    t = time.time()
+    for chunk in chunks:
+        sink.write(chunk)
+    sink.close()
+    return time.time() - t, len(sink.output)
+
+
+def memory(lines):
+    strings = list(lines)
+    size = sys.getsizeof(strings) + sum(map(sys.getsizeof, strings))
+    store = Lines()
+    for x in xrange(0, len(lines), CHUNK):
+        store.extend('\n'.join(lines[x:x + CHUNK]))
+    store[0]
+    return size, (sys.getsizeof(store.data) +
+        store.ends.itemsize * len(store.ends))
+
+
+def main():
+    lines, chunks = table()
+    print '%-36s %12s %12s' % ('filter', 'bytes out', 'lines/s')
+    for command in ('grep .*', 'tail -n 10', 'count', 'sum -f 4',
+            'cut -f 1,3', 'sort -n -k 4 | tail -n 1',
+            'cut -f 3 | sort | uniq -c', 'begin ethernet3/47',
+            'section ethernet2'):
+        elapsed, size = measure(command, chunks)
+        print '%-36s %12d %12d' % (command, size, LINES / elapsed)
+
+    strings, store = memory(lines)
+    print
+    print '%-36s %12s' % ('sort buffer', 'bytes')
+    print '%-36s %12d' % ('list of strings', strings)
+    print '%-36s %12d' % ('line store', store)
+
+
+if __name__ == '__main__':
+    main()
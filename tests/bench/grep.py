@@ -0,0 +1,54 @@
+'''
+Measure the throughput of grep, inc and exc over a large output, written in
+chunks like a command that formats a table, and how long it takes to set up
+the same filter many times, like a dashboard that refreshes every session.
+'''
+
+from cli.filter import Filter
+from cli.sink import Sink
+import time
+
+LINES = 200000
+CHUNK = 64
+SETUPS = 20000
+
+
+def table():
+    lines = ['ethernet%d/%d is %s, line protocol is %s' % (x % 4, x % 48,
+        ('up', 'down')[x % 3 == 0], ('up', 'down')[x % 5 == 0])
+        for x in xrange(LINES)]
+    return ['\n'.join(lines[x:x + CHUNK]) + '\n'
+        for x in xrange(0, len(lines), CHUNK)]
+
+
+def measure(filter, command, chunks):
+    sink = Sink()
+    filter.execute(sink, command)
+    t = time.time()
+    for chunk in chunks:
+        sink.write(chunk)
+    sink.close()
+    return time.time() - t, sink.output.count('\n')
+
+
+def setup(filter, command):
+    t = time.time()
+    for x in xrange(SETUPS):
+        filter.execute(Sink(), command)
+    return time.time() - t
+
+
+def main():
+    filter = Filter(None)
+    chunks = table()
+    print '%-42s %10s %12s %12s' % ('filter', 'matches', 'lines/s',
+        'setup (us)')
+    for command in ('grep ethernet1/.* is up', 'grep -v .*down.*down',
+            'grep -c -i ETHERNET3', 'inc ethernet2/4', 'exc ethernet0'):
+        elapsed, matches = measure(filter, command, chunks)
+        print '%-42s %10d %12d %12.1f' % (command, matches,
+            LINES / elapsed, setup(filter, command) * 1e6 / SETUPS)
+
+
+if __name__ == '__main__':
+    main()
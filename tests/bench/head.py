@@ -0,0 +1,85 @@
+'''
+Pipe a command writing a million lines through ``grep | head``, and measure
+the lines the command got to write, the time taken and the peak memory.
+Streaming through the filters stops the command as soon as ``head`` has
+seen enough; filtering the collected output, as before the filters
+streamed, runs the command to the end and holds all of its output.
+'''
+
+from cli.filter import Filter
+from cli.sink import BrokenPipe, Sink
+import os
+import time
+
+LINES = 1000000
+PIPES = ('grep .* up | head -n 10', 'grep .* up | count')
+
+
+def command(sink):
+    written = 0
+    try:
+        for x in xrange(LINES):
+            sink.write('ethernet%d/%d is %s\n' % (x % 4, x % 48,
+                ('up', 'down')[x % 3 == 0]))
+            written += 1
+    except BrokenPipe:
+        pass
+    return written
+
+
+def streamed(pipe):
+    filter = Filter(None)
+    sink = Sink()
+    for part in pipe.split(' | '):
+        filter.execute(sink, part)
+    written = command(sink)
+    sink.close()
+    return written, len(sink.output)
+
+
+def collected(pipe):
+    sink = Sink()
+    written = command(sink)
+    filter = Filter(None)
+    output = Sink()
+    for part in pipe.split(' | '):
+        filter.execute(output, part)
+    try:
+        output.write(sink.output)
+    except BrokenPipe:
+        pass
+    output.close()
+    return written, len(output.output)
+
+
+def measure(func, pipe):
+    # every case runs in a child of its own, so it has its own peak memory
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        t = time.time()
+        written, size = func(pipe)
+        os.write(write, '%d %d %f' % (written, size, time.time() - t))
+        os._exit(0)
+
+    os.close(write)
+    data = os.read(read, 4096)
+    os.close(read)
+    pid, status, usage = os.wait4(pid, 0)
+    written, size, elapsed = data.split()
+    return int(written), int(size), float(elapsed), usage.ru_maxrss
+
+
+def main():
+    print '%-24s %10s %12s %10s %10s %14s' % ('pipe', 'mode', 'written',
+        'bytes out', 'time (ms)', 'peak rss (kB)')
+    for pipe in PIPES:
+        for name, func in (('streamed', streamed), ('collected', collected)):
+            written, size, elapsed, peak = measure(func, pipe)
+            print '%-24s %10s %12d %10d %10.1f %14d' % (pipe, name, written,
+                size, elapsed * 1000, peak)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+'''
+Measure the time taken to show the syntax of every candidate for "?", and
+to show the help of a command, parsing the docstring every time versus the
+help record that is parsed once.
+'''
+
+from cli.section import Section, SectionType, command, get_help
+import textwrap
+import time
+
+ROUNDS = 100
+DOC = '''
+    syntax:  command%05d [<options>] <name>
+    example: command%05d -v test
+
+    options:
+        -a  Show all entries
+        -v  Show details
+
+    shows the entries with the given name; this line stands in for the
+    longer description that most commands have
+    '''
+
+
+def build(size):
+    attrs = dict(name='big')
+    for x in xrange(size):
+        func = lambda self, sink: None
+        func.__doc__ = DOC % (x, x)
+        attrs['command%05d' % (x,)] = command(func)
+    return SectionType('Big', (Section,), attrs)()
+
+
+def old_syntax(section, item):
+    node, handler, args = section.resolve(item.split())
+    docs = node and (handler.__doc__ or '')
+    if docs:
+        for line in docs.strip().splitlines():
+            if line.startswith('syntax:'):
+                return ' '.join(line.split()[2:])
+    return ''
+
+
+def new_syntax(section, item):
+    help = section._get_help(item)
+    return help and help.arguments or ''
+
+
+def old_help(section, item):
+    node, handler, args = section.resolve(item.split())
+    return '\r\n'.join(textwrap.dedent(handler.__doc__).strip().splitlines())
+
+
+def new_help(section, item):
+    return section._get_help(item).text
+
+
+def measure(func, section, items):
+    t = time.time()
+    for x in xrange(ROUNDS):
+        for item in items:
+            func(section, item)
+    return (time.time() - t) * 1000 / ROUNDS
+
+
+def main():
+    print '%10s %14s %14s %14s %14s' % ('commands', 'old ? (ms)',
+        'new ? (ms)', 'old help (us)', 'new help (us)')
+    for size in (10, 100, 500):
+        section = build(size)
+        items = section.complete('')
+        assert map(lambda item: old_syntax(section, item), items) == \
+            map(lambda item: new_syntax(section, item), items)
+        print '%10d %14.3f %14.3f %14.1f %14.1f' % (size,
+            measure(old_syntax, section, items),
+            measure(new_syntax, section, items),
+            measure(old_help, section, items[:1]) * 1000,
+            measure(new_help, section, items[:1]) * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+'''
+Measure the time taken by an incremental reverse search in a large history,
+scanning a reversed copy of the history for every key versus the n-gram
+index that resumes from the last hit.
+'''
+
+from cli.history import History
+import random
+import time
+
+WORDS = ('show', 'set', 'interfaces', 'ethernet', 'brief', 'detail', 'ip',
+    'route', 'bgp', 'neighbor', 'summary', 'ping', 'traceroute', 'vlan')
+
+
+def lines(size):
+    random.seed(0)
+    lines = []
+    for x in xrange(size):
+        words = random.sample(WORDS, 4)
+        words.append(str(random.randint(0, 100000)))
+        lines.append(' '.join(words))
+    return lines
+
+
+def scan(history, query):
+    for size in xrange(1, len(query) + 1):
+        filter = query[:size]
+        for item in history[::-1]:
+            if filter in item:
+                break
+
+
+def indexed(history, query):
+    position = None
+    for size in xrange(1, len(query) + 1):
+        number = history.search_backward(query[:size], position)
+        if number is not None:
+            position = number
+
+
+def main():
+    print '%10s %14s %14s %14s' % ('history', 'build (ms)', 'scan (ms)',
+        'indexed (ms)')
+    for size in (1000, 10000, 100000):
+        history = lines(size)
+        t = time.time()
+        history = History(history)
+        built = time.time() - t
+        for query in ('neighbor summary 12345', 'no such command'):
+            t = time.time()
+            scan(history, query)
+            scanned = time.time() - t
+            t = time.time()
+            indexed(history, query)
+            found = time.time() - t
+            print '%10d %14.1f %14.1f %14.1f' % (size, built * 1000,
+                scanned * 1000, found * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+'''
+Measure a CPU heavy grep over a large output, matching lines inline versus
+in child processes, and the CPU time taken by the process serving the
+sessions.
+'''
+
+from cli.filter import Filter
+from cli.sink import Sink
+import resource
+import time
+
+LINES = 200000
+PATTERN = r'.*(\d+)\s+\w+\s+(up|down)\s+\1.*$'
+
+
+def cputime():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(processes):
+    Filter.processes = processes
+    filter = Filter(None)
+    sink = Sink()
+    filter.execute(sink, 'grep %s' % (PATTERN,))
+    t, c = time.time(), cputime()
+    for x in xrange(LINES):
+        sink.write('ethernet%d %d link %s %d\n' % (x % 48, x,
+            ('up', 'down')[x % 2], x % 7))
+    sink.close()
+    return time.time() - t, cputime() - c, sink.output.count('\n')
+
+
+def main():
+    print '%10s %12s %12s %10s' % ('processes', 'wall (ms)', 'cpu (ms)',
+        'matches')
+    for processes in (0, 1, 2, 4):
+        wall, cpu, matches = measure(processes)
+        print '%10d %12.1f %12.1f %10d' % (processes, wall * 1000, cpu * 1000,
+            matches)
+
+
+if __name__ == '__main__':
+    main()
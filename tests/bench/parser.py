@@ -0,0 +1,34 @@
+'''
+Measure the number of tokens per second produced by the regular expression
+tokenizer versus the shlex based tokenizer.
+'''
+
+from cli.parser import parse, parse_shlex
+import time
+
+LINES = (
+    'show status | inc up',
+    'show interfaces ethernet0/1 detail | grep -i "input errors" | head -n 5',
+    'set description \'uplink to core\' > running-config',
+)
+ROUNDS = 20000
+
+
+def measure(tokenize):
+    tokens = 0
+    t = time.time()
+    for x in xrange(ROUNDS):
+        for line in LINES:
+            for token in tokenize(line):
+                tokens += 1
+    return tokens / (time.time() - t)
+
+
+def main():
+    print '%10s %16s' % ('parser', 'tokens/s')
+    for name, tokenize in (('shlex', parse_shlex), ('regex', parse)):
+        print '%10s %16.0f' % (name, measure(tokenize))
+
+
+if __name__ == '__main__':
+    main()
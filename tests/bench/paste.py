@@ -0,0 +1,77 @@
+'''
+Measure how long it takes to process a pasted 100 KB command script, reading
+one byte per call versus reading in chunks.
+'''
+
+from cli import Interface
+from cli.section import Section, command
+import time
+
+SCRIPT_SIZE = 100 * 1024
+
+
+class Noop(Section):
+    name = 'noop'
+
+    @command
+    def run(self, sink, *args):
+        pass
+
+
+class Socket(object):
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+        self.sent = 0
+        self.calls = 0
+
+    def __len__(self):
+        return len(self.data) - self.offset
+
+    def recv(self, bufsize=4096, flags=0):
+        data = self.data[self.offset:self.offset + bufsize]
+        self.offset += len(data)
+        return data
+
+    def send(self, data, flags=0):
+        self.sent += len(data)
+        self.calls += 1
+        return len(data)
+
+
+def script():
+    lines = []
+    size = 0
+    while size < SCRIPT_SIZE:
+        line = 'noop run %d with some arguments \x1b[D\x1b[C\r' % (len(lines),)
+        lines.append(line)
+        size += len(line)
+    return ''.join(lines)
+
+
+def measure(data, recv_size):
+    socket = Socket(data)
+    cli = Interface(socket)
+    cli.recv_size = recv_size
+    cli.root.addchild(Noop())
+    t = time.time()
+    calls = 0
+    while socket:
+        cli.read()
+        calls += 1
+    return time.time() - t, calls, socket.calls, socket.sent
+
+
+def main():
+    data = script()
+    print '%d bytes, %d lines' % (len(data), data.count('\r'))
+    print '%10s %12s %12s %12s %12s' % ('recv size', 'time (ms)', 'reads',
+        'sends', 'bytes out')
+    for recv_size in (1, 4096):
+        elapsed, reads, sends, sent = measure(data, recv_size)
+        print '%10d %12.1f %12d %12d %12d' % (recv_size, elapsed * 1000,
+            reads, sends, sent)
+
+
+if __name__ == '__main__':
+    main()
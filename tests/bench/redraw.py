@@ -0,0 +1,69 @@
+'''
+Count the bytes sent to the terminal while editing a command line, with the
+full line repaint versus the incremental line update.
+'''
+
+from cli import Interface
+
+
+class Socket(object):
+    def __init__(self):
+        self.sent = 0
+
+    def send(self, data, flags=0):
+        self.sent += len(data)
+        return len(data)
+
+
+class RepaintInterface(Interface):
+    '''
+    Interface with the original full line repaint on every update.
+    '''
+
+    def buffer_update(self, new_buffer, linepos=None):
+        self.send('\r%s%s' % (self.prompt, ' ' * len(self.buffer)))
+        self.buffer = new_buffer
+        self.send('\r%s%s' % (self.prompt, self.buffer))
+        if linepos is None:
+            self.linepos = len(self.buffer)
+        else:
+            linepos = max(0, min(len(self.buffer), linepos))
+            self.send('\b' * (max(0, len(self.buffer) - linepos)))
+            self.linepos = linepos
+
+
+def typing(size):
+    '''
+    Type a line of the given size, go back to the middle of the line,
+    insert a word there and delete it again.
+    '''
+    keys = [chr(ord('a') + i % 26) for i in xrange(size)]
+    keys.extend(['\x1b[D'] * (size // 2))
+    keys.extend('inserted ')
+    keys.extend(['\x7f'] * len('inserted '))
+    keys.extend(['\x1b[C'] * (size // 2))
+    return keys
+
+
+def measure(cls, keys):
+    socket = Socket()
+    cli = cls(socket)
+    for key in keys:
+        cli.handle_key(key)
+        cli.flush()
+    return socket.sent
+
+
+def main():
+    print '%8s %8s %14s %14s %8s' % ('length', 'keys', 'repaint (B)',
+        'update (B)', 'ratio')
+    for size in (10, 80, 200, 1000):
+        keys = typing(size)
+        repaint = measure(RepaintInterface, keys)
+        update = measure(Interface, keys)
+        print '%8d %8d %14d %14d %7.1fx' % (size, len(keys), repaint, update,
+            float(repaint) / update)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+'''
+Measure per-keystroke latency of one active session while an increasing
+number of idle sessions is connected to the same server.
+'''
+
+from cli.server import Server
+import resource
+import socket
+import threading
+import time
+
+KEYSTROKES = 200
+SESSIONS = (1, 10, 100, 1000)
+
+
+def cputime():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def drain(client, timeout=0.005):
+    client.settimeout(timeout)
+    try:
+        while client.recv(4096):
+            pass
+    except socket.timeout:
+        pass
+    client.settimeout(None)
+
+
+def connect(address, count):
+    clients = []
+    for x in xrange(count):
+        client = socket.create_connection(address)
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        clients.append(client)
+    return clients
+
+
+def measure(client):
+    samples = []
+    for x in xrange(KEYSTROKES):
+        t = time.time()
+        client.sendall(x % 2 and '\x7f' or 'a')
+        client.recv(4096)
+        samples.append(time.time() - t)
+        drain(client)
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.99)]
+
+
+def main():
+    server = Server(('127.0.0.1', 0))
+    thread = threading.Thread(target=server.loop)
+    thread.daemon = True
+    thread.start()
+    address = server.getsockname()
+
+    print '%8s %12s %12s %12s' % ('sessions', 'p50 (ms)', 'p99 (ms)',
+        'idle cpu')
+    clients = []
+    for count in SESSIONS:
+        clients.extend(connect(address, count - len(clients)))
+        while len(server) < count:
+            time.sleep(0.01)
+        for client in clients:
+            drain(client, 0.0001)
+
+        t = cputime()
+        time.sleep(1)
+        idle = cputime() - t
+
+        p50, p99 = measure(clients[0])
+        print '%8d %12.3f %12.3f %11.3fs' % (count, p50 * 1000, p99 * 1000,
+            idle)
+
+    for client in clients:
+        client.close()
+    while len(server):
+        time.sleep(0.01)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+'''
+Compare the original list of ``(time, data)`` tuples sink buffer with the
+current chunk list buffer, for commands producing many small writes.
+'''
+
+from cli.sink import Sink
+from operator import add
+import time
+
+
+class OldFileLike(list):
+    def write(self, data):
+        self.append((time.time(), data))
+
+    def tell(self):
+        return len(''.join((chunk[1] for chunk in self)))
+
+    def flush(self):
+        for x in xrange(0, len(self)):
+            self.pop(0)
+
+
+class OldSink(object):
+    def __init__(self):
+        self.buffers = dict(stdout=OldFileLike(), stderr=OldFileLike())
+
+    def __iter__(self):
+        for chunk in sorted(reduce(add, self.buffers.values())):
+            yield chunk[1]
+
+    @property
+    def output(self):
+        return ''.join(list(iter(self)))
+
+    def write(self, data):
+        self.buffers['stdout'].write(data)
+
+    def error(self, data):
+        self.buffers['stderr'].write(data)
+
+    def flush(self):
+        for item in self.buffers:
+            self.buffers[item].flush()
+
+
+def measure(cls, writes):
+    sink = cls()
+    timings = []
+    t = time.time()
+    for x in xrange(writes):
+        sink.write('line %d\n' % (x,))
+        if x % 10 == 0:
+            sink.error('error %d\n' % (x,))
+    timings.append(time.time() - t)
+
+    t = time.time()
+    for x in xrange(100):
+        sink.buffers['stdout'].tell()
+    timings.append(time.time() - t)
+
+    t = time.time()
+    sink.output
+    timings.append(time.time() - t)
+
+    t = time.time()
+    sink.flush()
+    timings.append(time.time() - t)
+    return timings
+
+
+def main():
+    print '%8s %6s %12s %12s %12s %12s' % ('writes', 'sink', 'write (ms)',
+        'tell x100', 'output (ms)', 'flush (ms)')
+    for writes in (1000, 10000, 100000):
+        for name, cls in (('old', OldSink), ('new', Sink)):
+            timings = measure(cls, writes)
+            print '%8d %6s %12.1f %12.1f %12.1f %12.1f' % tuple([writes, name] +
+                [timing * 1000 for timing in timings])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+'''
+Measure the cost of recording statistics: commands per second through the
+interface, and lines per second through a filter pipe, with statistics
+disabled versus enabled.
+'''
+
+from cli import Interface
+from cli.section import Section, command
+from cli.sink import Sink
+from cli.stats import stats
+import time
+
+COMMANDS = 20000
+LINES = 200000
+
+
+class Socket(object):
+    def send(self, data, flags=0):
+        return len(data)
+
+
+class Show(Section):
+    name = 'show'
+
+    @command
+    def version(self, sink, *args):
+        sink.write('1.0\n')
+
+    @command
+    def lines(self, sink, *args):
+        for x in xrange(LINES):
+            sink.write('line %d\n' % (x,))
+
+
+def commands(cli):
+    steps = cli.compile('show version')
+    t = time.time()
+    for x in xrange(COMMANDS):
+        for step in cli.evaluate(Sink(), steps, 'show version'):
+            pass
+    return COMMANDS / (time.time() - t)
+
+
+def lines(cli):
+    steps = cli.compile('show lines | inc line 1 | exc line 12 | count')
+    t = time.time()
+    for step in cli.evaluate(Sink(), steps, 'show lines'):
+        pass
+    return LINES / (time.time() - t)
+
+
+def main():
+    cli = Interface(Socket())
+    cli.root.addchild(Show())
+    print '%10s %14s %14s' % ('stats', 'commands/s', 'lines/s')
+    for enabled in (False, True):
+        stats.enabled = enabled
+        print '%10s %14d %14d' % (enabled and 'on' or 'off', commands(cli),
+            lines(cli))
+
+
+if __name__ == '__main__':
+    main()
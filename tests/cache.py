@@ -0,0 +1,31 @@
+from cli.cache import LRU
+import unittest
+
+generation = [0]
+
+class Test(unittest.TestCase):
+    cache = LRU(2, lambda: generation[0])
+
+    def test_1_set(self):
+        self.cache['foo'] = 1
+        self.cache['bar'] = 2
+        self.assertEqual(len(self.cache), 2)
+
+    def test_2_get(self):
+        self.assertEqual(self.cache.get('foo'), 1)
+        self.assertEqual(self.cache.get('biz'), None)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_3_evict(self):
+        self.cache['biz'] = 3
+        self.assertTrue('foo' in self.cache)
+        self.assertFalse('bar' in self.cache)
+        self.assertRaises(KeyError, lambda: self.cache['bar'])
+
+    def test_4_generation(self):
+        generation[0] += 1
+        self.assertFalse('foo' in self.cache)
+        self.assertEqual(len(self.cache), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+from cli.errors import Errors
+import unittest
+
+def fail(count):
+    raise ValueError('failure %d' % (count,))
+
+class Test(unittest.TestCase):
+    errors = Errors(3)
+
+    def test_1_empty(self):
+        self.assertEqual(len(self.errors), 0)
+        self.assertEqual(self.errors.traceback(), None)
+
+    def test_2_append(self):
+        for count in xrange(5):
+            try:
+                fail(count)
+            except ValueError, error:
+                self.errors.append(error)
+        self.assertEqual((len(self.errors), self.errors.total), (3, 5))
+        self.assertEqual(str(self.errors.error()), 'failure 4')
+        self.assertEqual(str(self.errors.error(3)), 'failure 2')
+        self.assertEqual(self.errors.error(4), None)
+
+    def test_3_traceback(self):
+        # tracebacks are formatted when they are asked for
+        self.assertFalse(isinstance(self.errors.items[-2][1], str))
+        trace = self.errors.traceback(2)
+        self.assertTrue('in fail' in trace)
+        self.assertTrue(trace.endswith('ValueError: failure 3\n'))
+        self.assertEqual(self.errors.items[-2][1], trace)
+        self.assertEqual(self.errors.traceback(0), None)
+
+    def test_4_string(self):
+        self.errors.append(ValueError('remote'), 'remote traceback\n')
+        self.assertEqual(self.errors.traceback(), 'remote traceback\n')
+        self.errors.clear()
+        self.assertEqual(len(self.errors), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+from cli.executor import Executor, Job, ProcessPool, call_in_process
+from cli.errors import Errors
+from cli.sink import Sink
+import time
+import unittest
+
+def produce(sink, count):
+    for x in xrange(int(count)):
+        sink.write('%d\n' % (x,))
+    return 'done'
+
+def steps(sink, count):
+    for x in xrange(int(count)):
+        sink.write('%d\n' % (x,))
+        yield
+
+def upper(data, suffix):
+    return data.upper() + suffix
+
+def fail(sink):
+    raise ValueError('failed')
+
+class Test(unittest.TestCase):
+    executor = Executor(2)
+
+    def run_job(self, job):
+        output = []
+        self.executor.submit(job)
+        while not job.done:
+            job.wait(1)
+            job.changed.clear()
+            job.drain(output.append)
+        job.drain(output.append)
+        return ''.join(output)
+
+    def test_1_run(self):
+        sink = Sink()
+        job = Job(produce, sink, 3)
+        sink.redirect(job.write)
+        self.assertEqual(self.run_job(job), '0\n1\n2\n')
+        self.assertEqual(job.result, 'done')
+
+    def test_2_error(self):
+        job = Job(fail, Sink())
+        self.run_job(job)
+        self.assertTrue(isinstance(job.error, ValueError))
+        # the traceback is formatted when it is needed
+        errors = Errors()
+        errors.append(job.error, job.traceback)
+        self.assertTrue('failed' in errors.traceback())
+
+    def test_3_cancel(self):
+        sink = Sink()
+        sink.cancel()
+        job = Job(produce, sink, 3)
+        self.assertEqual(self.run_job(job), '')
+        self.assertEqual(job.result, None)
+
+    def test_4_process(self):
+        sink = Sink()
+        job = Job(call_in_process, sink, produce, 3)
+        sink.redirect(job.write)
+        self.assertEqual(self.run_job(job), '0\n1\n2\n')
+        # coroutine commands run to completion in the child
+        sink = Sink()
+        job = Job(call_in_process, sink, steps, 3)
+        sink.redirect(job.write)
+        self.assertEqual(self.run_job(job), '0\n1\n2\n')
+        job = Job(call_in_process, Sink(), fail)
+        self.run_job(job)
+        self.assertTrue(isinstance(job.error, ValueError))
+        self.assertTrue('in fail' in job.traceback)
+
+    def test_5_park(self):
+        # a job waiting for its output to be drained leaves the single
+        # worker to the next job
+        executor = Executor(1)
+        sink = Sink()
+        stalled = Job(produce, sink, 100000)
+        sink.redirect(stalled.write)
+        executor.submit(stalled)
+        while not stalled.size >= stalled.high_water:
+            time.sleep(0.01)
+        sink = Sink()
+        job = Job(produce, sink, 3)
+        sink.redirect(job.write)
+        executor.submit(job)
+        for x in xrange(100):
+            if job.done:
+                break
+            time.sleep(0.01)
+        self.assertTrue(job.done)
+        self.assertEqual(len(executor.threads), 2)
+        while not stalled.done:
+            stalled.drain(lambda data: None)
+            stalled.wait(0.1)
+        executor.shutdown()
+        self.assertEqual(executor.threads, [])
+
+    def test_6_process_pool(self):
+        # workers are reused, unless they still owe an answer
+        processes = ProcessPool(1)
+        worker = processes.acquire()
+        worker.send(upper, ('!',), 'abc')
+        self.assertEqual(worker.recv(), 'ABC!')
+        processes.release(worker)
+        self.assertTrue(processes.acquire() is worker)
+        worker.send(upper, ('',), 'abc')
+        processes.release(worker)
+        self.assertEqual(processes.workers, [])
+        self.assertFalse(worker.process.is_alive())
+        other = processes.acquire()
+        self.assertFalse(other is worker)
+        processes.release(other)
+        processes.shutdown()
+        self.assertFalse(other.process.is_alive())
+
+    def test_7_shutdown(self):
+        self.executor.shutdown()
+        self.assertEqual(self.executor.threads, [])
+
+if __name__ == '__main__':
+    unittest.main()
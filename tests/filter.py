@@ -0,0 +1,219 @@
+from cli import Interface
+from cli.executor import Executor, Job
+from cli.filter import Filter, finder, finders
+from cli.section import Section, command
+from cli.sink import Sink, BrokenPipe
+import sys
+import threading
+import unittest
+
+class Socket(object):
+    def send(self, data):
+        return len(data)
+
+class Boom(Section):
+    name = 'boom'
+
+    @command
+    def now(self, sink):
+        self.sendline(sink, '1')
+        raise RuntimeError('boom')
+
+class Test(unittest.TestCase):
+    filter = Filter(None)
+
+    def run_pipe(self, filters, lines):
+        sink = Sink()
+        for part in filters:
+            self.assertTrue(self.filter.execute(sink, part))
+        written = 0
+        try:
+            for line in lines:
+                sink.write(line + '\n')
+                written += 1
+        except BrokenPipe:
+            pass
+        sink.close()
+        return str(sink.output), written
+
+    def test_1_grep(self):
+        output, written = self.run_pipe(['grep ba'], ['foo', 'bar', 'baz'])
+        self.assertEqual(output, 'bar\r\nbaz\r\n')
+
+    def test_2_grep_options(self):
+        output, written = self.run_pipe(['grep -c -i BA'], ['foo', 'bar', 'baz'])
+        self.assertEqual(output, '2\r\n')
+        output, written = self.run_pipe(['grep -v ba'], ['foo', 'bar', 'baz'])
+        self.assertEqual(output, 'foo\r\n')
+
+    def test_3_inc_exc(self):
+        output, written = self.run_pipe(['inc a.', 'exc a.c'],
+            ['a.b', 'abc', 'a.c'])
+        self.assertEqual(output, 'a.b\r\n')
+
+    def test_4_head(self):
+        lines = ('line %d' % (x,) for x in xrange(1000000))
+        output, written = self.run_pipe(['inc line 1', 'head -n 3'], lines)
+        self.assertEqual(output, 'line 1\r\nline 10\r\nline 11\r\n')
+        # the write that completed the head breaks the pipe
+        self.assertEqual(written, 11)
+        output, written = self.run_pipe(['head -n 0'], ['foo'])
+        self.assertEqual((output, written), ('', 0))
+
+    def test_5_partial(self):
+        sink = Sink()
+        self.filter.execute(sink, 'grep -c x')
+        sink.write('x\nx')
+        sink.close()
+        self.assertEqual(str(sink.output), '2\r\n')
+
+    def test_6_processes(self):
+        Filter.processes = 2
+        try:
+            lines = ['line %d' % (x,) for x in xrange(5000)]
+            output, written = self.run_pipe(['grep line.*7$'], lines)
+            self.assertEqual(output.split('\r\n')[:3], ['line 7', 'line 17',
+                'line 27'])
+            self.assertEqual(output.count('\r\n'), 500)
+            output, written = self.run_pipe(['grep -c -v line.*7$'], lines)
+            self.assertEqual(output, '4500\r\n')
+            # the command runs in a worker, so the session is not blocked
+            # while the children grep
+            cli = Interface(Socket())
+            cli.executor = Executor(1)
+            sink = Sink(stream=cli.stream)
+            task = cli.pipeline(sink, cli.compile('version | grep -c .'))
+            for step in task:
+                self.assertTrue(isinstance(step, Job))
+                step.wait()
+            sink.close()
+            self.assertEqual(len(cli.executor.threads), 1)
+            cli.executor.shutdown()
+            version = Sink()
+            cli.root.execute(version, 'version')
+            self.assertEqual(''.join(cli.output), '%d\r\n' % (
+                version.output.count('\n'),))
+        finally:
+            Filter.processes = 0
+
+    def test_7_blocks(self):
+        lines = ['a', 'ab\r\nb', 'a', '', 'ba\nab']
+        output, written = self.run_pipe(['grep a'], lines)
+        self.assertEqual(output, 'a\r\nab\r\na\r\nab\r\n')
+        output, written = self.run_pipe(['grep -v a'], lines)
+        self.assertEqual(output, 'b\r\n\r\nba\r\n')
+        output, written = self.run_pipe(['grep -c -v a'], lines)
+        self.assertEqual(output, '3\r\n')
+        # matches may not run into the next line, or look past the line
+        output, written = self.run_pipe(['grep a\s*b'], ['a', 'b', 'a b'])
+        self.assertEqual(output, 'a b\r\n')
+        output, written = self.run_pipe(['grep a(?!\s)'], ['a', 'b', 'a b'])
+        self.assertEqual(output, 'a\r\n')
+
+    def test_8_literal(self):
+        lines = ['a.b', 'a.c\nabc\n', 'a.b.c']
+        output, written = self.run_pipe(['inc a.'], lines)
+        self.assertEqual(output, 'a.b\r\na.c\r\na.b.c\r\n')
+        output, written = self.run_pipe(['exc a.b'], lines)
+        self.assertEqual(output, 'a.c\r\nabc\r\n\r\n')
+        output, written = self.run_pipe(['inc'], ['a', 'b'])
+        self.assertEqual(output, 'a\r\nb\r\n')
+        self.assertTrue(finder('x.', 0, True) is finder('x.', 0, True))
+
+    def test_9_tail(self):
+        lines = ('line %d' % (x,) for x in xrange(1000))
+        output, written = self.run_pipe(['tail -n 2'], lines)
+        self.assertEqual(output, 'line 998\r\nline 999\r\n')
+        sink = Sink()
+        self.filter.execute(sink, 'tail -n x')
+        self.assertEqual(str(sink.output), 'tail: invalid numeric value\r\n')
+
+    def test_10_count(self):
+        output, written = self.run_pipe(['count'], ['a\nb', 'c'])
+        self.assertEqual(output, '3\r\n')
+        output, written = self.run_pipe(['count b|c'], ['a\nb', 'c'])
+        self.assertEqual(output, '2\r\n')
+
+    def test_11_sort_uniq(self):
+        lines = ['b 10', 'a 9\nc 10', 'b 10']
+        output, written = self.run_pipe(['sort'], lines)
+        self.assertEqual(output, 'a 9\r\nb 10\r\nb 10\r\nc 10\r\n')
+        output, written = self.run_pipe(['sort -n -r -k 2', 'head -n 1'],
+            lines)
+        self.assertEqual(output, 'b 10\r\n')
+        output, written = self.run_pipe(['sort', 'uniq -c'], lines)
+        self.assertEqual(output, '      1 a 9\r\n      2 b 10\r\n'
+            '      1 c 10\r\n')
+
+    def test_12_cut_sum(self):
+        lines = ['eth0  up  10', 'eth1 down 20', 'total']
+        output, written = self.run_pipe(['cut -f 1,3-'], lines)
+        self.assertEqual(output, 'eth0 10\r\neth1 20\r\ntotal\r\n')
+        output, written = self.run_pipe(['cut -d , -f 2'], ['a,b,c'])
+        self.assertEqual(output, 'b\r\n')
+        output, written = self.run_pipe(['sum -f 3'], lines)
+        self.assertEqual(output, '30\r\n')
+        output, written = self.run_pipe(['sum'], ['1.5', '2'])
+        self.assertEqual(output, '3.5\r\n')
+
+    def test_13_begin_section(self):
+        config = ['hostname cli', 'interface eth0\n ip 10.0.0.1',
+            ' shutdown\ninterface eth1', ' ip 10.0.0.2\nline vty']
+        output, written = self.run_pipe(['begin interface'], config)
+        self.assertEqual(output, 'interface eth0\r\n ip 10.0.0.1\r\n'
+            ' shutdown\r\ninterface eth1\r\n ip 10.0.0.2\r\nline vty\r\n')
+        output, written = self.run_pipe(['section interface eth1'], config)
+        self.assertEqual(output, 'interface eth1\r\n ip 10.0.0.2\r\n')
+
+    def test_14_failure(self):
+        # summaries are left out when the command failed
+        cli = Interface(Socket())
+        cli.root.addchild(Boom())
+
+        def run(line):
+            cli.output = []
+            cli.handle_command(line)
+            return ''.join(cli.output).split('\r\n')
+
+        self.assertTrue(run('version | count')[0].isdigit())
+        for line in ['nothing | count', 'boom now | sum',
+            'boom now | grep -c 1']:
+            output = run(line)
+            self.assertTrue(output[0].startswith('e'))
+            self.assertFalse(filter(str.isdigit, output))
+        Filter.processes = 2
+        try:
+            output = run('boom now | grep -c 1')
+            self.assertTrue(output[0].startswith('exception'))
+            self.assertFalse(filter(str.isdigit, output))
+        finally:
+            Filter.processes = 0
+
+    def test_15_threads(self):
+        # the finder cache is shared by sessions running in threads
+        errors = []
+
+        def find(offset):
+            try:
+                for x in xrange(3000):
+                    finder('x%d' % ((x * 7 + offset) % 300,), 0, True)
+            except Exception, error:
+                errors.append(error)
+
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            threads = [threading.Thread(target=find, args=(x,))
+                for x in xrange(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setcheckinterval(interval)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(finders), len(list(finders.items)))
+        self.assertTrue(finder('x1', 0, True) is finder('x1', 0, True))
+
+if __name__ == '__main__':
+    unittest.main()
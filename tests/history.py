@@ -1,4 +1,8 @@
-from cli.history import History
+from cli.history import History, HistoryFile, SharedHistory
+from cli.history import UniqueHistory, ngrams
+import os
+import shutil
+import tempfile
 import unittest
 
 class Test(unittest.TestCase):
@@ -27,6 +31,87 @@ class Test(unittest.TestCase):
     def test_7_complete_forward(self):
         self.assertEqual(self.history.complete_forward('b'), 'bar')
 
+    def test_8_search(self):
+        history = History(['show version', 'show interfaces', 'ping host',
+            'show interfaces brief'])
+        self.assertEqual(history.search_backward('interfaces'), 3)
+        self.assertEqual(history.search_backward('interfaces', 2), 1)
+        self.assertEqual(history.search_backward('interfaces', 0), None)
+        self.assertEqual(history.search_forward('show', 1), 1)
+        self.assertEqual(history.search_forward('show', 2), 3)
+        self.assertEqual(history.search_forward('sh', 2), 3)
+        self.assertEqual(history.search_forward('xyz'), None)
+        history.append('ping other')
+        self.assertEqual(history.search_backward('ping'), 4)
+
+    def test_9_file(self):
+        path = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(path, 'history')
+            history = HistoryFile(filename)
+            history.window = 4
+            for x in xrange(20):
+                history.append('command %d' % (x,))
+            self.assertEqual(len(history), 20)
+            self.assertTrue(history.base > 0)
+            self.assertEqual(history[1], 'command 1')
+            self.assertEqual(history.search_backward('command 1', 12), 12)
+            self.assertEqual(history.search_backward('command 2', 12), 2)
+            self.assertEqual(history.search_forward('command 1', 2), 10)
+            history.close()
+
+            # a second writer shares the file
+            other = HistoryFile(filename)
+            other.limit = 10
+            other.append('command 0')
+            other.compact()
+            self.assertEqual(len(other), 10)
+            self.assertEqual(other[-1], 'command 0')
+            self.assertEqual(other[0], 'command 11')
+            other.close()
+        finally:
+            shutil.rmtree(path)
+
+    def test_10_shared(self):
+        shared = SharedHistory()
+        one, two = shared.cursor(), shared.cursor()
+        one.append('show ' + 'version')
+        two.append('show version')
+        two.append('ping')
+        self.assertEqual(len(shared), 2)
+        self.assertEqual(len(one), 2)
+        self.assertTrue(shared.store[0] is intern('show version'))
+        self.assertEqual(one.position, 0)
+        self.assertEqual(two.current(), 'ping')
+        self.assertEqual(two.backward(), 'show version')
+        self.assertEqual(one.complete_backward('pi'), 'ping')
+        self.assertEqual(list(one), ['show version', 'ping'])
+
+    def test_11_unique(self):
+        history = UniqueHistory(['show version', 'show interfaces', 'ping',
+            'show version'])
+        self.assertEqual(list(history), ['show interfaces', 'ping',
+            'show version'])
+        self.assertEqual(history.search_backward('show'), 2)
+        self.assertEqual(history.search_backward('show', 1), 0)
+        self.assertEqual(history.search_forward('show', 1), 2)
+        self.assertEqual(history.search_forward('s', 1), 2)
+        self.assertEqual(history.search_backward('xyz'), None)
+        self.assertEqual(history.backward(), 'ping')
+
+        # many sessions repeating the same commands store them once
+        shared = SharedHistory()
+        cursors = [shared.cursor() for x in xrange(100)]
+        for x in xrange(10):
+            for cursor in cursors:
+                cursor.append('show status')
+                cursor.append('show status | inc up')
+        self.assertEqual(len(shared), 2)
+        self.assertEqual(sum(map(len, shared.store.index.values())),
+            len(ngrams('show status')) + len(ngrams('show status | inc up')))
+        self.assertEqual(cursors[0].complete_backward('inc'),
+            'show status | inc up')
+
 if __name__ == '__main__':
     unittest.main()
 
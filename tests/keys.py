@@ -0,0 +1,44 @@
+from cli import Interface
+from cli.keys import Decoder
+import unittest
+
+class Test(unittest.TestCase):
+    decoder = Decoder(Interface.sequence)
+
+    def test_1_text(self):
+        self.assertEqual(self.decoder.feed('show version\r'),
+            ['show version', '\r'])
+
+    def test_2_help(self):
+        self.assertEqual(self.decoder.feed('sh?'), ['sh', '?'])
+
+    def test_3_sequence(self):
+        self.assertEqual(self.decoder.feed('\x1b[A\x1b[15~\x1bOP'),
+            ['\x1b[A', '\x1b[15~', '\x1bOP'])
+        self.assertEqual(self.decoder.lookup('\x1b[15~'), 'F5')
+
+    def test_4_partial(self):
+        self.assertEqual(self.decoder.feed('ls\x1b[1'), ['ls'])
+        self.assertEqual(len(self.decoder), 3)
+        self.assertEqual(self.decoder.feed('5'), [])
+        self.assertEqual(self.decoder.feed('~\x7f'), ['\x1b[15~', '\x7f'])
+        self.assertEqual(len(self.decoder), 0)
+
+    def test_5_modifiers(self):
+        keys = self.decoder.feed('\x1b[1;5D\x1b[H\x1b[3;2~')
+        self.assertEqual(map(self.decoder.lookup, keys),
+            ['ctrl-left', 'home', 'shift-del'])
+
+    def test_6_unknown(self):
+        self.assertEqual(self.decoder.feed('\x1b[200~x'), ['\x1b[200~', 'x'])
+        self.assertEqual(self.decoder.lookup('\x1b[200~'), None)
+
+    def test_7_expire(self):
+        self.assertEqual(self.decoder.feed('\x1b'), [])
+        self.assertEqual(self.decoder.expire(self.decoder.started), [])
+        self.assertEqual(self.decoder.expire(self.decoder.deadline), ['\x1b'])
+        self.assertEqual(self.decoder.lookup('\x1b'), 'esc')
+        self.assertEqual(self.decoder.feed('\x1b\r'), ['\x1b', '\r'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,4 @@
-from cli.parser import parse
+from cli.parser import parse, ParseError
 import unittest
 
 class Test(unittest.TestCase):
@@ -43,6 +43,21 @@ class Test(unittest.TestCase):
                 self.assertEqual(token.__class__.__name__, name)
                 self.assertEqual(str(token), word)
 
+    def test_4_quoting(self):
+        self.assertEqual(list(parse('a"b c"d "x\\"y" \\| # comment')),
+            ['ab cd', 'x"y', '|'])
+        self.assertEqual(list(parse('"" a')), ['', 'a'])
+
+    def test_5_position(self):
+        self.assertEqual([token.position for token in parse(' a |b')],
+            [1, 3, 4])
+        try:
+            list(parse('show "foo'))
+        except ParseError, error:
+            self.assertEqual(error.position, 5)
+        else:
+            self.fail('expected ParseError')
+
 if __name__ == '__main__':
     unittest.main()
 
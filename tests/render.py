@@ -0,0 +1,35 @@
+from cli.render import Line
+import unittest
+
+class Test(unittest.TestCase):
+    line = Line()
+
+    def test_1_repaint(self):
+        self.assertEqual(self.line.update('> ', 'show', 4), '\r> show\x1b[K')
+
+    def test_2_append(self):
+        self.assertEqual(self.line.update('> ', 'show ver', 8), ' ver')
+
+    def test_3_move(self):
+        self.assertEqual(self.line.update('> ', 'show ver', 6), '\b\b')
+        self.assertEqual(self.line.update('> ', 'show ver', 0), '\x1b[6D')
+        self.assertEqual(self.line.update('> ', 'show ver', 2), 'sh')
+
+    def test_4_insert(self):
+        self.line.update('> ', 'show interfaces brief', 5)
+        self.assertEqual(self.line.update('> ', 'show all interfaces brief', 9),
+            '\x1b[4@all ')
+
+    def test_5_delete(self):
+        self.assertEqual(self.line.update('> ', 'show interfaces brief', 5),
+            '\x1b[4D\x1b[4P')
+
+    def test_6_erase(self):
+        self.assertEqual(self.line.update('> ', 'show', 4), '\b\x1b[K')
+
+    def test_7_invalidate(self):
+        self.line.invalidate()
+        self.assertEqual(self.line.update('> ', 'show', 4), '\r> show\x1b[K')
+
+if __name__ == '__main__':
+    unittest.main()
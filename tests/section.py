@@ -0,0 +1,132 @@
+from cli import Interface
+from cli.section import Section, command, get_help, startswith
+from cli.sink import Sink
+import unittest
+
+class Base(Section):
+    name = 'base'
+
+    @command
+    def show(self, sink):
+        pass
+
+    @command
+    def set(self, sink):
+        '''
+        syntax:  set [<options>] <name> <value>
+        example: set -f mtu 1500
+
+        options:
+            -f  Force the change
+            -q  Be quiet
+
+        sets a value
+        '''
+
+    def helper(self):
+        pass
+
+class Child(Base):
+    name = 'child'
+
+    @command
+    def clear(self, sink):
+        pass
+
+class Socket(object):
+    def send(self, data):
+        return len(data)
+
+class Test(unittest.TestCase):
+    section = Child()
+
+    def test_1_commands(self):
+        self.assertEqual(self.section.commands, ('clear', 'set', 'show'))
+        self.assertTrue('show' in self.section)
+        self.assertFalse('helper' in self.section)
+
+    def test_2_complete(self):
+        self.assertEqual(sorted(self.section.complete('s')), ['set', 'show'])
+        self.assertEqual(startswith(('a', 'ab', 'b'), 'a'), ('a', 'ab'))
+
+    def test_3_class_change(self):
+        Base.reset = command(lambda self, sink: None)
+        self.assertEqual(self.section.commands, ('clear', 'reset', 'set',
+            'show'))
+        del Base.reset
+        self.assertEqual(self.section.commands, ('clear', 'set', 'show'))
+
+    def test_4_tree(self):
+        root = Base()
+        for name in ('interfaces', 'ip', 'bgp'):
+            child = Child()
+            child.name = name
+            root.addchild(child)
+        self.assertEqual(root.complete('i'), ['interfaces', 'ip'])
+        self.assertEqual(root.complete('ip c'), ['ip clear'])
+        self.assertEqual(root.complete('ip  s'), ['ip set', 'ip show'])
+        self.assertEqual(root.complete('foo s'), [])
+        root.delchild(root.getchild('ip'))
+        self.assertEqual(root.complete('i'), ['interfaces'])
+
+    def test_5_resolve(self):
+        root = Base()
+        child = Child()
+        child.name = 'ip'
+        root.addchild(child)
+        node, handler, args = root.resolve(['ip', 'clear', 'a b'])
+        self.assertEqual((node, handler.__name__, args), (child, 'clear',
+            ['a b']))
+        node, handler, args = root.resolve(['ip', 'ip'])
+        self.assertEqual((node, handler), (None, None))
+        self.assertEqual(root.lookup('ip show x'), (child, 'show', ['x']))
+        self.assertEqual(root.descend(['ip', 'foo']), (child, 1))
+
+    def test_6_help(self):
+        help = self.section._get_help('set')
+        self.assertEqual(help.syntax, 'set [<options>] <name> <value>')
+        self.assertEqual(help.arguments, '[<options>] <name> <value>')
+        self.assertEqual(help.example, 'set -f mtu 1500')
+        self.assertEqual(help.options, [('-f', 'Force the change'),
+            ('-q', 'Be quiet')])
+        self.assertEqual(help.description, 'sets a value')
+        self.assertTrue(help.text.startswith('syntax:  set'))
+        self.assertTrue('\r\n    -f  Force' in help.text)
+        # parsed once, for every instance of the section
+        self.assertTrue(get_help(Child().set) is help)
+        self.assertEqual(self.section._get_help('show').text, '')
+        self.assertEqual(self.section._get_help('foo'), None)
+
+    def test_7_traceback(self):
+        cli = Interface(Socket())
+        try:
+            raise ValueError('failure')
+        except ValueError, error:
+            cli.errors.append(error)
+        for line, output in [('traceback', 'exception 1 of 1:'),
+            ('traceback 1', 'exception 1 of 1:'),
+            ('traceback 0', 'no traceback available'),
+            ('traceback 2', 'no traceback available'),
+            ('traceback x', 'no traceback available')]:
+            sink = Sink()
+            cli.root.execute(sink, line)
+            self.assertEqual(sink.output.split('\r\n')[0], output)
+
+    def test_8_cache(self):
+        # changing one tree keeps the compiled lines of other trees
+        one, two = Interface(Socket()), Interface(Socket())
+        one.compile('version')
+        two.root.addchild(Child())
+        one.compile('version')
+        self.assertEqual((one.cache.hits, one.cache.misses), (1, 1))
+        one.root.addchild(Child())
+        one.compile('version')
+        self.assertEqual((one.cache.hits, one.cache.misses), (1, 2))
+        # as does changing a section deeper down the tree
+        one.compile('version')
+        one.root.getchild('child').addchild(Base())
+        one.compile('version')
+        self.assertEqual((one.cache.hits, one.cache.misses), (2, 3))
+
+if __name__ == '__main__':
+    unittest.main()
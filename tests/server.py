@@ -0,0 +1,173 @@
+from cli.section import Section, command
+from cli.server import Server, Session
+import socket
+import threading
+import time
+import unittest
+
+class Count(Section):
+    name = 'count'
+
+    @command
+    def to(self, sink, count):
+        for x in xrange(int(count)):
+            self.sendline(sink, str(x))
+            yield
+
+    @command(offload='process')
+    def squares(self, sink, count):
+        for x in xrange(int(count)):
+            self.sendline(sink, str(x * x))
+
+    @command
+    def lines(self, sink, count):
+        for x in xrange(int(count)):
+            self.sendline(sink, '%08d' % (x,))
+
+    @command(offload='thread')
+    def forever(self, sink):
+        while True:
+            self.sendline(sink, 'tick')
+            time.sleep(0.01)
+
+
+class FailingSession(Session):
+    def handle_key(self, key):
+        if key == '\x07':
+            raise RuntimeError('bell')
+        Session.handle_key(self, key)
+
+
+class CountServer(Server):
+    session_class = FailingSession
+
+    def setup(self, session):
+        session.root.addchild(Count())
+
+
+class Test(unittest.TestCase):
+    server = CountServer(('127.0.0.1', 0))
+    thread = threading.Thread(target=server.loop)
+    thread.daemon = True
+    thread.start()
+    clients = []
+
+    def recv_until(self, client, data):
+        buffer = ''
+        while data not in buffer:
+            buffer += client.recv(4096)
+        return buffer
+
+    def wait_for(self, sessions):
+        for x in xrange(100):
+            if len(self.server) == sessions:
+                break
+            time.sleep(0.01)
+
+    def test_1_connect(self):
+        for x in xrange(3):
+            client = socket.create_connection(self.server.getsockname())
+            self.recv_until(client, 'cli % ')
+            self.clients.append(client)
+        self.wait_for(3)
+        self.assertEqual(len(self.server), 3)
+
+    def test_2_command(self):
+        client = self.clients[1]
+        client.sendall('version\r')
+        self.assertTrue('created by' in self.recv_until(client, 'created by'))
+        # a line with only a comment does nothing
+        client.sendall('# note\rversion\r')
+        output = self.recv_until(client, 'created by')
+        self.assertFalse('error' in output)
+        self.assertEqual(len(self.server), 3)
+
+    def test_3_coroutine(self):
+        client = self.clients[2]
+        client.sendall('count to 1000\rversion\r')
+        output = self.recv_until(client, 'created by')
+        self.assertTrue('\r\n999\r\n' in output)
+        self.assertTrue(output.index('999') < output.index('created by'))
+
+    def test_4_thread(self):
+        client = self.clients[2]
+        client.sendall('count forever\r')
+        self.recv_until(client, 'tick')
+        client.sendall('\x03version\r')
+        output = self.recv_until(client, 'created by')
+        self.assertTrue('^C' in output)
+
+        client.sendall('count squares 1000\rversion\r')
+        output = self.recv_until(client, 'created by')
+        self.assertTrue('\r\n998001\r\n' in output)
+        self.assertTrue(output.index('998001') < output.index('created by'))
+
+    def test_5_backpressure(self):
+        # plain commands run inline, unless the session offloads them; an
+        # offloaded command stops producing while the client does not read
+        client = self.clients[2]
+        session = [session for session in self.server.sessions.values()
+            if session.address == client.getsockname()][0]
+        client.sendall('count lines 10\r')
+        self.recv_until(client, '00000009')
+        self.assertEqual(session.task, None)
+
+        session.offload = 'thread'
+        try:
+            session.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                65536)
+            client.sendall('count lines 200000\r')
+            time.sleep(0.5)
+            self.assertTrue(session.task is not None)
+            self.assertTrue(session.outgoing_size < 256 * 1024)
+            client.sendall('version\r')
+            output = self.recv_until(client, 'created by')
+            self.assertTrue('\r\n00199999\r\n' in output)
+            self.assertTrue(output.index('00199999') <
+                output.index('created by'))
+        finally:
+            del session.offload
+
+    def test_6_profile(self):
+        client = self.clients[1]
+        client.sendall('profile -n 5 count to 30 | inc 2 | count\rversion\r')
+        output = self.recv_until(client, 'created by')
+        self.assertTrue('\r\n11\r\n' in output)
+        self.assertTrue('function calls' in output)
+        client.sendall('profile -o x version\rversion\r')
+        output = self.recv_until(client, 'created by')
+        self.assertTrue('profile: no profile directory' in output)
+
+    def test_7_failure(self):
+        # an unexpected error only drops the session that caused it
+        client = socket.create_connection(self.server.getsockname())
+        self.recv_until(client, 'cli % ')
+        self.wait_for(4)
+        client.sendall('\x07')
+        while client.recv(4096):
+            pass
+        self.wait_for(3)
+        self.assertEqual(len(self.server), 3)
+        self.test_2_command()
+
+    def test_8_exit(self):
+        client = self.clients.pop(0)
+        client.sendall('exit\r')
+        output = ''
+        while True:
+            data = client.recv(4096)
+            if not data:
+                break
+            output += data
+        self.assertTrue('bye' in output)
+        self.wait_for(2)
+        self.assertEqual(len(self.server), 2)
+
+    def test_9_disconnect(self):
+        while self.clients:
+            self.clients.pop().close()
+        self.wait_for(0)
+        self.assertEqual(len(self.server), 0)
+
+if __name__ == '__main__':
+    unittest.main()
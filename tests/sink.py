@@ -18,6 +18,36 @@ class Test(unittest.TestCase):
     def test_3_call(self):
         self.sink.stdout('call')
 
+    def test_4_stream(self):
+        chunks = []
+        sink = Sink(stream=chunks.append)
+        sink.write('testing\n')
+        sink.error('123\n')
+        sink.stdout = 'world\n'
+        self.assertEqual(chunks, ['testing\n', '123\n', 'world\n'])
+        self.assertEqual(str(sink.output), '')
+
+    def test_5_flush(self):
+        sink = Sink()
+        for x in xrange(1000):
+            sink.write('o%d ' % (x,))
+            sink.error('e%d ' % (x,))
+        self.assertEqual(sink.output.split()[:4], ['o0', 'e0', 'o1', 'e1'])
+        self.assertEqual(sink.stdout.tell(), len(str(sink.stdout)))
+        sink.flush()
+        self.assertEqual(sink.stdout.tell(), 0)
+        self.assertEqual(sink.output, '')
+        # flushing one buffer leaves the runs of the other
+        sink.write('a ')
+        sink.error('b ')
+        sink.write('c ')
+        sink.stdout = 'd '
+        sink.error('e ')
+        self.assertEqual(sink.output, 'b d e ')
+        sink.stderr.flush()
+        sink.write('f ')
+        self.assertEqual(sink.output, 'd f ')
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,53 @@
+from cli.filter import Filter
+from cli.sink import Sink
+from cli.stats import Histogram, Stats, stats
+import unittest
+
+class Test(unittest.TestCase):
+    stats = Stats()
+
+    def test_1_histogram(self):
+        histogram = Histogram()
+        for value in (0.0, 1e-7, 0.001, 0.002, 0.003, 1e9):
+            histogram.add(value)
+        self.assertEqual(histogram.count, 6)
+        self.assertEqual(histogram.max, 1e9)
+        self.assertEqual(histogram.percentile(0), 1e-6)
+        self.assertEqual(histogram.percentile(50), 0.001024)
+        self.assertEqual(histogram.percentile(100), 1e9)
+
+    def test_2_record(self):
+        self.stats.count('bytes in', 10)
+        self.stats.count('bytes in', 5)
+        self.stats.record('show version', 0.5)
+        self.stats.record('show version', 1.5)
+        snapshot = self.stats.snapshot()
+        self.assertEqual(snapshot['counters'], {'bytes in': 15})
+        summary = snapshot['histograms']['show version']
+        self.assertEqual((summary['count'], summary['total'],
+            summary['mean'], summary['max']), (2, 2.0, 1.0, 1.5))
+
+    def test_3_reset(self):
+        self.stats.reset()
+        self.assertEqual(self.stats.snapshot(), dict(counters={},
+            histograms={}))
+
+    def test_4_stages(self):
+        stats.enabled = True
+        try:
+            sink = Sink()
+            filter = Filter(None)
+            for part in ('inc a', 'exc ab', 'count a'):
+                filter.execute(sink, part)
+            sink.write('a\nab\nb\n')
+            sink.close()
+        finally:
+            stats.enabled = False
+        self.assertEqual(str(sink.output), '1\r\n')
+        # every filter is timed on its own
+        snapshot = stats.snapshot()['histograms']
+        for name in ('| inc', '| exc', '| count', 'output'):
+            self.assertEqual(snapshot[name]['count'], 1)
+
+if __name__ == '__main__':
+    unittest.main()